@@ -6,6 +6,7 @@ import os
 import sys
 from pathlib import Path
 import time
+import threading
 
 # Add src to path
 sys.path.insert(0, str(Path(__file__).parent))
@@ -22,7 +23,11 @@ st.set_page_config(
 )
 
 # Custom CSS
-st.markdown("""
+@st.cache_resource
+def _custom_css() -> str:
+    """Stylesheet, built once per process and injected on each run"""
+    # Kept flush-left: indented lines would render as a markdown code block
+    return """
 <style>
     .main-header {
         font-size: 2.5rem;
@@ -37,12 +42,6 @@ st.markdown("""
         text-align: center;
         margin-bottom: 2rem;
     }
-    .source-box {
-        background-color: #f0f2f6;
-        padding: 1rem;
-        border-radius: 0.5rem;
-        margin-bottom: 0.5rem;
-    }
     .messy-data-alert {
         background-color: #fff3cd;
         padding: 1rem;
@@ -50,13 +49,41 @@ st.markdown("""
         border-left: 4px solid #ffc107;
     }
 </style>
-""", unsafe_allow_html=True)
+"""
+
+
+st.markdown(_custom_css(), unsafe_allow_html=True)
+
+
+@st.cache_resource
+def get_pipeline() -> RAGPipeline:
+    """Create the RAG pipeline once per process and share it across sessions"""
+    pipeline = RAGPipeline()
+    
+    # Load the models while the user is still reading the UI
+    threading.Thread(target=pipeline.warmup, daemon=True).start()
+    pipeline.start_keepalive()
+    
+    return pipeline
+
+
+@st.cache_data(ttl=10)
+def _cached_stats(_pipeline: RAGPipeline) -> dict:
+    """System stats, cached so widget reruns don't hit Ollama every time"""
+    return _pipeline.get_stats()
+
+
+@st.cache_data(ttl=30)
+def _cached_ollama_ok(_pipeline: RAGPipeline) -> bool:
+    """Ollama health check, cached across reruns"""
+    return _pipeline.check_ollama()
 
 
 # Initialize session state
-if 'rag_pipeline' not in st.session_state:
-    st.session_state.rag_pipeline = RAGPipeline()
+st.session_state.rag_pipeline = get_pipeline()
+if 'chat_history' not in st.session_state:
     st.session_state.chat_history = []
+    st.session_state.sources_pool = {}
     st.session_state.uploaded_files = []
 
 
@@ -68,206 +95,282 @@ def main():
     st.markdown('<div class="sub-header">Your Intelligent Educational Document Assistant</div>', 
                 unsafe_allow_html=True)
     
-    # Sidebar
+    # Sidebar and tabs are fragments, so a widget change only reruns its own section
     with st.sidebar:
-        st.header("⚙️ Settings")
-        
-        # Check Ollama status
-        if st.session_state.rag_pipeline.check_ollama():
-            st.success("✅ Ollama Connected")
-        else:
-            st.error("❌ Ollama Not Available")
-            st.info("Please ensure Ollama is running on http://localhost:11434")
-        
-        st.divider()
-        
-        # System stats
-        st.subheader("📊 System Stats")
-        stats = st.session_state.rag_pipeline.get_stats()
-        
-        col1, col2 = st.columns(2)
-        with col1:
-            st.metric("Documents", stats['total_documents'])
-            st.metric("Chunks", stats['total_chunks'])
-        with col2:
-            st.metric("Models", len(stats['models_available']))
-        
-        st.divider()
-
-        # Model selection
-        st.subheader("🧠 Model Selection")
-        models = stats.get('models_available', []) or []
-        default_model = config.LLM_MODEL
-        model_options = models if len(models) > 0 else [default_model]
-
-        # Persist selected model in session state
-        if 'selected_model' not in st.session_state:
-            # prefer default if present in options
-            try:
-                default_index = model_options.index(default_model) if default_model in model_options else 0
-            except Exception:
-                default_index = 0
-            st.session_state.selected_model = model_options[default_index]
-
-        selected_model = st.selectbox(
-            "Choose LLM model to use",
-            options=model_options,
-            index=model_options.index(st.session_state.selected_model) if st.session_state.get('selected_model') in model_options else 0,
-            help="Select which Ollama model to use for generation"
-        )
-
-        # Apply selected model to the pipeline's Ollama client
-        if selected_model:
-            st.session_state.selected_model = selected_model
-            try:
-                st.session_state.rag_pipeline.ollama.llm_model = selected_model
-            except Exception:
-                # If assignment fails, continue without crashing the UI
-                pass
-        
-        # Settings
-        st.subheader("🎛️ Query Settings")
-        top_k = st.slider("Number of chunks to retrieve", 1, 10, config.TOP_K_RETRIEVAL)
-        use_rerank = st.checkbox("Use LLM Reranking", value=False, 
-                                help="More accurate but slower")
-        
-        st.divider()
-        
-        # Clear data
-        if st.button("🗑️ Clear All Data", type="secondary"):
-            if st.session_state.rag_pipeline.vector_store.get_stats()['total_chunks'] > 0:
-                st.session_state.rag_pipeline.vector_store.clear()
-                st.session_state.rag_pipeline.vector_store.save()
-                st.session_state.chat_history = []
-                st.success("All data cleared!")
-                st.rerun()
+        render_sidebar()
     
     # Main tabs
     tab1, tab2, tab3, tab4 = st.tabs(["📤 Upload Documents", "💬 Ask Questions", 
                                        "🔍 Analyze Messy Data", "📋 Document Library"])
     
-    # Tab 1: Upload Documents
     with tab1:
-        st.header("Upload Documents")
-        st.write("Upload any document to build your knowledge base. Supports PDF, DOCX, TXT, CSV, XLSX, and images.")
-        
-        uploaded_files = st.file_uploader(
-            "Choose files",
-            type=['pdf', 'docx', 'doc', 'txt', 'csv', 'xlsx', 'xls', 'png', 'jpg', 'jpeg'],
-            accept_multiple_files=True,
-            help="Upload multiple documents at once"
-        )
-        
-        if uploaded_files:
-            if st.button("📥 Process Documents", type="primary"):
-                process_documents(uploaded_files)
+        render_upload_tab()
     
-    # Tab 2: Ask Questions
     with tab2:
-        st.header("Ask Questions")
-        
-        if stats['total_chunks'] == 0:
-            st.info("👆 Please upload documents first to start asking questions!")
-        else:
-            # Chat interface
-            st.write(f"Ask questions about your {stats['total_documents']} uploaded document(s)")
-            
-            # Display chat history
-            for message in st.session_state.chat_history:
-                with st.chat_message(message["role"]):
-                    st.write(message["content"])
-                    if "sources" in message and message["sources"]:
-                        with st.expander("📚 View Sources"):
-                            for i, source in enumerate(message["sources"], 1):
-                                st.markdown(f"**Source {i}** (Score: {source['score']:.2f}) - {source['file_name']}")
-                                st.text(source['text'])
-            
-            # User input
-            user_question = st.chat_input("Ask a question about your documents...")
-            
-            if user_question:
-                # Add user message to chat
-                st.session_state.chat_history.append({
-                    "role": "user",
-                    "content": user_question
-                })
-                
-                # Display user message
-                with st.chat_message("user"):
-                    st.write(user_question)
-                
-                # Generate response
-                with st.chat_message("assistant"):
-                    with st.spinner("Thinking..."):
-                        result = st.session_state.rag_pipeline.query(
-                            user_question,
-                            top_k=top_k,
-                            use_rerank=use_rerank
-                        )
-                        
-                        st.write(result['answer'])
-                        
-                        # Show sources
-                        if result['sources']:
-                            with st.expander("📚 View Sources"):
-                                for i, source in enumerate(result['sources'], 1):
-                                    st.markdown(f"**Source {i}** (Score: {source['score']:.2f}) - {source['file_name']}")
-                                    st.text(source['text'])
-                        
-                        # Add assistant message to chat
-                        st.session_state.chat_history.append({
-                            "role": "assistant",
-                            "content": result['answer'],
-                            "sources": result['sources']
-                        })
-    
-    # Tab 3: Analyze Messy Data
+        render_chat_tab()
+    
     with tab3:
-        st.header("Analyze Messy/Unorganized Data")
-        st.write("Upload messy CSV/Excel files or unstructured data for AI-powered analysis")
-        
-        messy_file = st.file_uploader(
-            "Upload messy data file",
-            type=['csv', 'xlsx', 'xls'],
-            help="Upload a CSV or Excel file you don't understand",
-            key="messy_upload"
-        )
-        
-        if messy_file:
-            if st.button("🔍 Analyze Data", type="primary"):
-                analyze_messy_data(messy_file)
+        render_messy_data_tab()
     
-    # Tab 4: Document Library
     with tab4:
-        st.header("Document Library")
-        
-        if stats['total_documents'] == 0:
-            st.info("No documents uploaded yet.")
-        else:
-            st.write(f"Managing {stats['total_documents']} document(s)")
-            
-            # Show processed documents
-            for doc_hash, doc_info in st.session_state.rag_pipeline.processed_docs.items():
-                with st.expander(f"📄 {doc_info['file_name']}", expanded=False):
-                    col1, col2, col3 = st.columns([2, 2, 1])
-                    
-                    with col1:
-                        st.write(f"**Type:** {doc_info['file_type']}")
-                        st.write(f"**Chunks:** {doc_info['chunks']}")
-                    
-                    with col2:
-                        if doc_info.get('is_messy', False):
-                            st.warning("⚠️ Messy Data Detected")
-                    
-                    with col3:
-                        if st.button("🗑️ Delete", key=f"del_{doc_hash}"):
-                            result = st.session_state.rag_pipeline.delete_document(doc_info['file_name'])
-                            st.success(f"Deleted {result['chunks_removed']} chunks")
-                            st.rerun()
-                    
-                    if doc_info.get('summary'):
-                        st.write("**Summary:**")
-                        st.info(doc_info['summary'])
+        render_library_tab()
+
+
+@st.fragment
+def render_sidebar():
+    """Sidebar with status, stats, model selection and query settings"""
+    st.header("⚙️ Settings")
+    
+    # Check Ollama status
+    if _cached_ollama_ok(st.session_state.rag_pipeline):
+        st.success("✅ Ollama Connected")
+    else:
+        st.error("❌ Ollama Not Available")
+        st.info("Please ensure Ollama is running on http://localhost:11434")
+    
+    st.divider()
+    
+    # System stats
+    st.subheader("📊 System Stats")
+    stats = _cached_stats(st.session_state.rag_pipeline)
+    
+    col1, col2 = st.columns(2)
+    with col1:
+        st.metric("Documents", stats['total_documents'])
+        st.metric("Chunks", stats['total_chunks'])
+    with col2:
+        st.metric("Models", len(stats['models_available']))
+    
+    st.divider()
+    
+    # Model selection
+    st.subheader("🧠 Model Selection")
+    models = stats.get('models_available', []) or []
+    default_model = config.LLM_MODEL
+    model_options = models if len(models) > 0 else [default_model]
+    
+    # Persist selected model in session state
+    if 'selected_model' not in st.session_state:
+        # prefer default if present in options
+        try:
+            default_index = model_options.index(default_model) if default_model in model_options else 0
+        except Exception:
+            default_index = 0
+        st.session_state.selected_model = model_options[default_index]
+    
+    selected_model = st.selectbox(
+        "Choose LLM model to use",
+        options=model_options,
+        index=model_options.index(st.session_state.selected_model) if st.session_state.get('selected_model') in model_options else 0,
+        help="Select which Ollama model to use for generation"
+    )
+    
+    # Keep the selection per session; the pipeline is shared, so the
+    # model is passed to each query instead of mutated on the client
+    if selected_model:
+        st.session_state.selected_model = selected_model
+    
+    # Settings
+    st.subheader("🎛️ Query Settings")
+    # Keyed so the chat tab can read them from session state
+    st.slider("Number of chunks to retrieve", 1, 10, config.TOP_K_RETRIEVAL, key="top_k")
+    st.checkbox("Use Reranking", value=False, key="use_rerank",
+                help="Re-score retrieved chunks with a cross-encoder (or the LLM if none is installed). More accurate but slower")
+    
+    st.divider()
+    
+    # Clear data
+    if st.button("🗑️ Clear All Data", type="secondary"):
+        if st.session_state.rag_pipeline.vector_store.get_stats()['total_chunks'] > 0:
+            st.session_state.rag_pipeline.clear_all()
+            _cached_stats.clear()
+            st.session_state.chat_history = []
+            st.session_state.sources_pool = {}
+            st.success("All data cleared!")
+            st.rerun()
+
+
+@st.fragment
+def render_upload_tab():
+    """Tab 1: Upload Documents"""
+    st.header("Upload Documents")
+    st.write("Upload any document to build your knowledge base. Supports PDF, DOCX, TXT, CSV, XLSX, and images.")
+    
+    uploaded_files = st.file_uploader(
+        "Choose files",
+        type=['pdf', 'docx', 'doc', 'txt', 'csv', 'xlsx', 'xls', 'png', 'jpg', 'jpeg'],
+        accept_multiple_files=True,
+        help="Upload multiple documents at once"
+    )
+    
+    if uploaded_files:
+        if st.button("📥 Process Documents", type="primary"):
+            process_documents(uploaded_files)
+
+
+@st.fragment
+def render_chat_tab():
+    """Tab 2: Ask Questions"""
+    stats = _cached_stats(st.session_state.rag_pipeline)
+    
+    st.header("Ask Questions")
+    
+    if stats['total_chunks'] == 0:
+        st.info("👆 Please upload documents first to start asking questions!")
+    else:
+        # Chat interface
+        st.write(f"Ask questions about your {stats['total_documents']} uploaded document(s)")
+    
+        # Display chat history; older messages collapse to one-line titles
+        history = st.session_state.chat_history
+        hidden = history[:-config.MAX_RENDERED_MESSAGES]
+        if hidden:
+            with st.expander(f"🕘 {len(hidden)} earlier message(s)"):
+                st.markdown("\n".join(
+                    f"- **{message['role'].title()}:** {message['content'][:80]}"
+                    for message in hidden
+                ))
+    
+        for message in history[-config.MAX_RENDERED_MESSAGES:]:
+            with st.chat_message(message["role"]):
+                st.write(message["content"])
+                sources = get_message_sources(message)
+                if sources:
+                    render_sources(sources)
+    
+        # User input
+        user_question = st.chat_input("Ask a question about your documents...")
+    
+        if user_question:
+            # Add user message to chat
+            add_chat_message("user", user_question)
+    
+            # Display user message
+            with st.chat_message("user"):
+                st.write(user_question)
+    
+            # Generate response
+            with st.chat_message("assistant"):
+                pipeline = st.session_state.rag_pipeline
+                try:
+                    # Sources are known before generation starts
+                    with st.spinner("Searching documents..."):
+                        context_chunks = pipeline.retrieve_context(
+                            user_question,
+                            top_k=st.session_state.top_k,
+                            use_rerank=st.session_state.use_rerank
+                        )
+                    sources = pipeline.format_sources(context_chunks)
+    
+                    # Stream tokens as they are generated
+                    answer = st.write_stream(pipeline.query_stream(
+                        user_question,
+                        model=st.session_state.selected_model,
+                        context_chunks=context_chunks
+                    ))
+                except Exception as e:
+                    sources = []
+                    answer = f"Error processing query: {str(e)}"
+                    st.write(answer)
+    
+                # Show sources
+                if sources:
+                    render_sources(sources)
+    
+                # Add assistant message to chat
+                add_chat_message("assistant", answer, sources)
+
+
+@st.fragment
+def render_messy_data_tab():
+    """Tab 3: Analyze Messy Data"""
+    st.header("Analyze Messy/Unorganized Data")
+    st.write("Upload messy CSV/Excel files or unstructured data for AI-powered analysis")
+    
+    messy_file = st.file_uploader(
+        "Upload messy data file",
+        type=['csv', 'xlsx', 'xls'],
+        help="Upload a CSV or Excel file you don't understand",
+        key="messy_upload"
+    )
+    
+    if messy_file:
+        if st.button("🔍 Analyze Data", type="primary"):
+            analyze_messy_data(messy_file)
+
+
+@st.fragment
+def render_library_tab():
+    """Tab 4: Document Library"""
+    stats = _cached_stats(st.session_state.rag_pipeline)
+    
+    st.header("Document Library")
+    
+    if stats['total_documents'] == 0:
+        st.info("No documents uploaded yet.")
+    else:
+        st.write(f"Managing {stats['total_documents']} document(s)")
+    
+        # Show processed documents
+        for doc_hash, doc_info in list(st.session_state.rag_pipeline.processed_docs.items()):
+            with st.expander(f"📄 {doc_info['file_name']}", expanded=False):
+                col1, col2, col3 = st.columns([2, 2, 1])
+    
+                with col1:
+                    st.write(f"**Type:** {doc_info['file_type']}")
+                    st.write(f"**Chunks:** {doc_info['chunks']}")
+    
+                with col2:
+                    if doc_info.get('is_messy', False):
+                        st.warning("⚠️ Messy Data Detected")
+    
+                with col3:
+                    if st.button("🗑️ Delete", key=f"del_{doc_hash}"):
+                        result = st.session_state.rag_pipeline.delete_document(doc_info['file_name'])
+                        _cached_stats.clear()
+                        st.success(f"Deleted {result['chunks_removed']} chunks")
+                        st.rerun()
+    
+                if doc_info.get('summary'):
+                    st.write("**Summary:**")
+                    st.info(doc_info['summary'])
+
+
+def add_chat_message(role, content, sources=None):
+    """
+    Append a message to the chat history
+    
+    Sources are stored once in the session's sources_pool and messages keep
+    only their ids, so repeated sources are not duplicated in session state.
+    """
+    source_ids = []
+    for source in sources or []:
+        source_id = f"{source['file_name']}#{source['chunk_position']}#{hash(source['text'])}"
+        st.session_state.sources_pool.setdefault(source_id, source)
+        source_ids.append(source_id)
+    
+    st.session_state.chat_history.append({
+        "role": role,
+        "content": content,
+        "source_ids": source_ids
+    })
+
+
+def get_message_sources(message):
+    """Look up the sources stored for a chat message"""
+    pool = st.session_state.sources_pool
+    return [pool[source_id] for source_id in message.get("source_ids", []) if source_id in pool]
+
+
+def render_sources(sources):
+    """Render retrieved sources in one expander with a single markdown element"""
+    md = "\n\n".join(
+        f"**Source {i}** (Score: {source['score']:.2f}) - {source['file_name']}\n\n"
+        f"```\n{source['text']}\n```"
+        for i, source in enumerate(sources, 1)
+    )
+    with st.expander("📚 View Sources"):
+        st.markdown(md)
 
 
 def process_documents(uploaded_files):
@@ -275,21 +378,22 @@ def process_documents(uploaded_files):
     progress_bar = st.progress(0)
     status_text = st.empty()
     
-    results = []
+    # Files are parsed from memory; the pipeline saves them after parsing
+    temp_paths = [os.path.join(config.UPLOAD_DIR, f.name) for f in uploaded_files]
+    file_data = [f.getvalue() for f in uploaded_files]
     
-    for i, uploaded_file in enumerate(uploaded_files):
-        # Save uploaded file temporarily
-        temp_path = os.path.join(config.UPLOAD_DIR, uploaded_file.name)
-        with open(temp_path, 'wb') as f:
-            f.write(uploaded_file.getbuffer())
-        
-        # Process document
-        status_text.text(f"Processing {uploaded_file.name}...")
-        result = st.session_state.rag_pipeline.ingest_document(temp_path)
-        results.append(result)
-        
-        # Update progress
-        progress_bar.progress((i + 1) / len(uploaded_files))
+    def update_progress(done, total, file_path):
+        progress_bar.progress(done / total)
+        if done < total:
+            status_text.text(f"Processed {os.path.basename(file_path)} ({done}/{total})...")
+        else:
+            status_text.text("Generating embeddings...")
+    
+    # Parse every file first, then embed all chunks together
+    status_text.text(f"Processing {len(uploaded_files)} document(s)...")
+    results = st.session_state.rag_pipeline.ingest_documents(temp_paths, update_progress,
+                                                             file_data=file_data)
+    _cached_stats.clear()
     
     # Show results
     status_text.empty()
@@ -322,13 +426,12 @@ def process_documents(uploaded_files):
 
 def analyze_messy_data(uploaded_file):
     """Analyze messy data file"""
-    # Save uploaded file temporarily
+    # Parsed from memory; the pipeline saves the file after parsing
     temp_path = os.path.join(config.UPLOAD_DIR, uploaded_file.name)
-    with open(temp_path, 'wb') as f:
-        f.write(uploaded_file.getbuffer())
     
     with st.spinner("Analyzing data with AI..."):
-        result = st.session_state.rag_pipeline.analyze_messy_data(temp_path)
+        result = st.session_state.rag_pipeline.analyze_messy_data(temp_path,
+                                                                  uploaded_file.getvalue())
     
     if result['status'] == 'success':
         st.success(f"✅ Analysis complete for {result['file_name']}")
@@ -361,6 +464,7 @@ def analyze_messy_data(uploaded_file):
         # Option to add to database
         if st.button("➕ Add to Document Database", type="primary"):
             ingest_result = st.session_state.rag_pipeline.ingest_document(temp_path)
+            _cached_stats.clear()
             if ingest_result['status'] == 'success':
                 st.success(f"Added to database: {ingest_result['chunks_added']} chunks")
                 st.rerun()
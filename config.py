@@ -6,30 +6,68 @@ import os
 # Ollama Configuration
 OLLAMA_BASE_URL = "http://localhost:11434"
 EMBEDDING_MODEL = "nomic-embed-text"
+EMBEDDING_BATCH_SIZE = 64  # Texts per /api/embed request
+EMBEDDING_CONCURRENCY = 4  # Embedding batches sent to Ollama at once during ingest
+EMBEDDING_CACHE_SIZE = 4096  # Recent embeddings (mostly queries) kept in memory
 LLM_MODEL = "qwen2.5:14b"  # Primary reasoning model
 FAST_LLM_MODEL = "deepseek-r1:7b"  # For quick operations
 VISION_MODEL = "llava:7b"  # For image understanding (optional)
+OLLAMA_POOL_SIZE = 32  # Pooled keep-alive HTTP connections to Ollama
+OLLAMA_CONNECT_RETRIES = 3  # Retries when a connection to Ollama cannot be opened
+OLLAMA_STATUS_TTL = 10  # Seconds is_available/list_models reuse the last model list
 
 # Model Parameters
 LLM_TEMPERATURE = 0.1  # Lower for more deterministic responses
 LLM_TOP_P = 0.9
 LLM_TOP_K = 40
 MAX_TOKENS = 2048
+TOKENIZER_ENCODING = "cl100k_base"  # tiktoken encoding for token counts (falls back to ~4 chars/token)
+OLLAMA_KEEP_ALIVE = "1h"  # How long Ollama keeps the model (and prompt cache) loaded (-1 = until Ollama stops)
+OLLAMA_KEEPALIVE_INTERVAL = 0  # Seconds between background re-warms that keep models loaded while idle (0 = off)
 
 # Vector Store Configuration
 VECTOR_DB_PATH = "./vector_store"
 FAISS_INDEX_PATH = os.path.join(VECTOR_DB_PATH, "faiss_index")
 METADATA_PATH = os.path.join(VECTOR_DB_PATH, "metadata.json")
 EMBEDDING_DIM = 768  # nomic-embed-text dimension
+FAISS_INDEX_TYPE = "HNSW32"  # faiss.index_factory string for new indexes ("Flat" for exact search); IVF/PQ layouts are refused here, reach them via FAISS_IVFPQ_THRESHOLD or rebuild_index()
+FAISS_HNSW_EF_CONSTRUCTION = 200  # Graph build quality for HNSW indexes
+FAISS_HNSW_EF_SEARCH = 64  # Search breadth for HNSW indexes (higher = better recall)
+FAISS_IVF_NPROBE = 16  # Inverted lists scanned per query once the index is IVF (after rebuild_index())
+FAISS_IVFPQ_THRESHOLD = 0  # Rebuild the index as IVF-PQ once it holds this many vectors (0 = never)
+FAISS_PQ_M = 16  # PQ sub-quantizers (bytes per vector) for IVF-PQ; must divide EMBEDDING_DIM
+FAISS_KEEP_RAW_VECTORS = False  # Also keep exact float32 vectors in vectors.f32 so deletes/rebuilds of lossy (PQ, int8) indexes stay exact
+FAISS_INDEX_MMAP = False  # Memory-map the saved index read-only on load (IVF lists page in on demand)
+FAISS_USE_GPU = False  # Move the index to all visible GPUs (needs faiss-gpu; Flat/IVF types, not HNSW)
+FAISS_THREADS = 0  # OpenMP threads for FAISS search/add (0 = half the CPU cores, leaving room for Ollama)
+FAISS_OPT_LEVEL = ""  # SIMD build of faiss-cpu to load: "avx512", "avx2" or "generic" ("" = auto-detect)
+VECTOR_QUANT = "fp16"  # Stored vector encoding for new indexes: "fp32", "fp16" (2x smaller) or "int8" (4x smaller)
+VECTOR_SAVE_EVERY = 50  # Single-file ingests between vector store saves (batches and exit always save)
+VECTOR_SAVE_INTERVAL = 60  # Seconds since the last save after which the next ingest saves anyway
 
 # Chunking Configuration
 CHUNK_SIZE = 1000  # Characters per chunk
 CHUNK_OVERLAP = 200  # Overlap between chunks
 MIN_CHUNK_SIZE = 100  # Minimum chunk size
 
+# Ingestion
+INGEST_WORKERS = 4  # Documents parsed/preprocessed in parallel per upload batch
+INGEST_STORE_BATCH = 256  # Chunks embedded and added to the vector store at a time during batch ingest
+PARSE_PROCESSES = 0  # Worker processes for CPU-bound parsing (DOCX, text, tables) in batch ingest; 0 parses on the ingest threads
+PDF_WORKERS = min(8, os.cpu_count() or 1)  # Processes used to extract pages of one PDF
+PDF_PARALLEL_MIN_PAGES = 4  # Smaller PDFs are extracted in-process
+PDF_EXTRACT_TABLES = False  # Run PyMuPDF table detection on every PDF page (slow)
+PREPROCESS_CONTEXT_CHARS = 10000  # Longest document excerpt a preprocessor LLM prompt sees
+
 # Document Processing
 UPLOAD_DIR = "./uploaded_documents"
 PROCESSED_DIR = "./processed_documents"
+CACHE_DIR = "./cache"
+OCR_CACHE_DIR = os.path.join(CACHE_DIR, "ocr")  # OCR text keyed by image content hash
+LLM_CACHE_DIR = os.path.join(CACHE_DIR, "llm")  # Preprocessor LLM outputs keyed by prompt hash
+EMBEDDING_CACHE_PATH = os.path.join(CACHE_DIR, "embeddings.sqlite")  # Chunk embeddings keyed by model + text hash
+EMBEDDING_CACHE_MAX_ENTRIES = 200000  # Disk-cached embeddings kept, least recently used evicted first (~3 KB each; 0 = off)
+LLM_CACHE_SEED = 0  # Fixed seed so cached preprocessor outputs are reproducible
 SUPPORTED_FORMATS = [
     ".pdf", ".docx", ".doc", ".txt", ".csv", ".xlsx", ".xls",
     ".png", ".jpg", ".jpeg", ".gif", ".bmp", ".tiff"
@@ -37,8 +75,12 @@ SUPPORTED_FORMATS = [
 
 # RAG Configuration
 TOP_K_RETRIEVAL = 5  # Number of chunks to retrieve
-SIMILARITY_THRESHOLD = 0.0  # Minimum similarity score (0.0 = no filtering, use all results)
+SIMILARITY_THRESHOLD = 0.0  # Minimum cosine similarity score (0.0 = no filtering, use all results)
 RERANK_TOP_K = 3  # Number of chunks after reranking
+RERANKER_MODEL = "BAAI/bge-reranker-base"  # Cross-encoder used when sentence-transformers is installed
+USE_LLM_RERANK = False  # Score chunks with LLM prompts instead of the cross-encoder
+RERANK_CACHE_SIZE = 8192  # Recent (query, chunk) rerank scores kept in memory
+RERANK_CONCURRENCY = 8  # Relevance prompts sent to Ollama at once when reranking
 
 # Messy Data Detection
 MESSY_DATA_THRESHOLD = 0.6  # Confidence threshold for messy data detection
@@ -47,14 +89,17 @@ MAX_COLUMN_ANALYSIS = 50  # Max columns to analyze for CSV/Excel
 # UI Configuration
 STREAMLIT_THEME = "dark"
 MAX_UPLOAD_SIZE_MB = 200
+MAX_RENDERED_MESSAGES = 20  # Chat messages rendered in full; older ones show as titles
 
 # Logging
 LOG_LEVEL = "INFO"
-LOG_FILE = "./logs/reasoning_rag.log"
+LOG_DIR = "./logs"
+LOG_FILE = os.path.join(LOG_DIR, "reasoning_rag.log")
+
 
-# Create necessary directories
-os.makedirs(VECTOR_DB_PATH, exist_ok=True)
-os.makedirs(UPLOAD_DIR, exist_ok=True)
-os.makedirs(PROCESSED_DIR, exist_ok=True)
-os.makedirs("./logs", exist_ok=True)
+def ensure_dirs():
+    """Create the data and log directories (kept out of import time)"""
+    for path in (VECTOR_DB_PATH, UPLOAD_DIR, PROCESSED_DIR, OCR_CACHE_DIR, LLM_CACHE_DIR,
+                 LOG_DIR):
+        os.makedirs(path, exist_ok=True)
 
@@ -3,9 +3,9 @@ Generation module for RAG system
 Generates educational responses using retrieved context
 """
 import logging
-from typing import List, Dict, Any, Optional, Iterator
+from typing import List, Dict, Any, Optional, Iterator, AsyncIterator, Tuple
 from src.utils.ollama_client import OllamaClient
-from src.utils.helpers import format_document_context, truncate_context
+from src.utils.helpers import format_document_context, truncate_context, fit_chunks_to_budget
 import config
 
 logger = logging.getLogger(__name__)
@@ -17,12 +17,21 @@ class Generator:
     Focused on educational, helpful responses
     """
     
+    SYSTEM_PROMPT = """You are an expert educational AI assistant. Your role is to:
+- Help users learn and understand information from documents
+- Provide clear, accurate, and well-reasoned explanations
+- Use the provided context to give informed answers
+- Explain complex concepts in accessible ways
+- Be honest when information is uncertain or incomplete
+- Focus on fostering understanding, not just providing answers"""
+    
     def __init__(self, ollama_client: Optional[OllamaClient] = None):
         self.ollama = ollama_client or OllamaClient()
     
     def generate_educational_response(self, query: str, 
                                      context_chunks: List[Dict[str, Any]],
-                                     stream: bool = False) -> str:
+                                     stream: bool = False,
+                                     model: Optional[str] = None) -> str:
         """
         Generate educational response based on query and context
         
@@ -30,61 +39,91 @@ class Generator:
             query: User question
             context_chunks: Retrieved relevant chunks
             stream: Whether to stream response
+            model: LLM model name (defaults to the client's model)
         
         Returns:
             Generated response
         """
         if not context_chunks:
-            return self._generate_no_context_response(query)
-        
-        # Format context
-        context_texts = [chunk['text'] for chunk in context_chunks]
-        formatted_context = format_document_context(context_texts)
+            return self._generate_no_context_response(query, model=model)
         
-        # Truncate if too long
-        formatted_context = truncate_context(formatted_context, max_tokens=4000)
-        
-        # Create educational prompt
-        prompt = self._create_educational_prompt(query, formatted_context, context_chunks)
+        prompt, system_prompt = self._build_prompt(query, context_chunks)
         
         # Generate response
-        system_prompt = self._get_system_prompt()
-        
         if stream:
-            return self._generate_stream(prompt, system_prompt)
+            return self.ollama.generate_stream(prompt, model=model, system=system_prompt)
         else:
-            response = self.ollama.generate(prompt, system=system_prompt)
+            response = self.ollama.generate(prompt, model=model, system=system_prompt)
             return response.strip()
     
     def generate_stream(self, query: str, 
-                       context_chunks: List[Dict[str, Any]]) -> Iterator[str]:
+                       context_chunks: List[Dict[str, Any]],
+                       model: Optional[str] = None) -> Iterator[str]:
         """
         Generate streaming response
         
+        Args:
+            query: User question
+            context_chunks: Retrieved relevant chunks
+            model: LLM model name (defaults to the client's model)
+        
         Yields:
             Response chunks as they are generated
         """
         if not context_chunks:
             prompt = f"Question: {query}\n\nPlease provide a helpful educational response."
+            system_prompt = self._get_system_prompt()
         else:
-            context_texts = [chunk['text'] for chunk in context_chunks]
-            formatted_context = format_document_context(context_texts)
-            formatted_context = truncate_context(formatted_context, max_tokens=4000)
-            prompt = self._create_educational_prompt(query, formatted_context, context_chunks)
+            prompt, system_prompt = self._build_prompt(query, context_chunks)
         
-        system_prompt = self._get_system_prompt()
+        for chunk in self.ollama.generate_stream(prompt, model=model, system=system_prompt):
+            yield chunk
+    
+    async def agenerate_stream(self, query: str,
+                               context_chunks: List[Dict[str, Any]],
+                               model: Optional[str] = None) -> AsyncIterator[str]:
+        """
+        Generate streaming response asynchronously (see generate_stream)
+        
+        Yields:
+            Response chunks as they are generated
+        """
+        if not context_chunks:
+            prompt = f"Question: {query}\n\nPlease provide a helpful educational response."
+            system_prompt = self._get_system_prompt()
+        else:
+            prompt, system_prompt = self._build_prompt(query, context_chunks)
         
-        for chunk in self.ollama.generate_stream(prompt, system=system_prompt):
+        async for chunk in self.ollama.agenerate_stream(prompt, model=model, system=system_prompt):
             yield chunk
     
+    def _build_prompt(self, query: str,
+                      context_chunks: List[Dict[str, Any]]) -> Tuple[str, str]:
+        """
+        Build the prompt and system prompt for a query with retrieved context
+        
+        Returns:
+            (prompt, system_prompt)
+        """
+        # Keep whole chunks that fit the context budget
+        context_texts = fit_chunks_to_budget(context_chunks, max_tokens=4000)
+        formatted_context = format_document_context(context_texts)
+        
+        # Tabular chunks carry (or reference) the LLM's data analysis
+        has_data_analysis = False
+        for chunk in context_chunks:
+            chunk_context = chunk.get('metadata', {}).get('context', {})
+            if 'analysis' in chunk_context or 'analysis_chunk_id' in chunk_context:
+                has_data_analysis = True
+                break
+        
+        prompt = self._create_educational_prompt(query, formatted_context, has_data_analysis)
+        return prompt, self._get_system_prompt()
+    
     def _create_educational_prompt(self, query: str, context: str,
-                                  chunks: List[Dict[str, Any]]) -> str:
+                                  has_data_analysis: bool = False) -> str:
         """Create prompt optimized for educational responses"""
         
-        # Check if context includes messy data analysis
-        has_data_analysis = any('data_analysis' in chunk.get('metadata', {}).get('context', {}) 
-                               for chunk in chunks)
-        
         if has_data_analysis:
             prompt = f"""You are an educational AI assistant helping a user understand data they may not fully comprehend.
 
@@ -124,15 +163,9 @@ Provide a clear, educational answer:"""
     
     def _get_system_prompt(self) -> str:
         """Get system prompt for educational assistant"""
-        return """You are an expert educational AI assistant. Your role is to:
-- Help users learn and understand information from documents
-- Provide clear, accurate, and well-reasoned explanations
-- Use the provided context to give informed answers
-- Explain complex concepts in accessible ways
-- Be honest when information is uncertain or incomplete
-- Focus on fostering understanding, not just providing answers"""
+        return self.SYSTEM_PROMPT
     
-    def _generate_no_context_response(self, query: str) -> str:
+    def _generate_no_context_response(self, query: str, model: Optional[str] = None) -> str:
         """Generate response when no relevant context is found"""
         prompt = f"""The user asked: "{query}"
 
@@ -146,7 +179,8 @@ Provide a helpful response that:
 Response:"""
         
         system_prompt = self._get_system_prompt()
-        response = self.ollama.generate(prompt, system=system_prompt, temperature=0.5)
+        response = self.ollama.generate(prompt, model=model, system=system_prompt,
+                                        temperature=0.5)
         
         return response.strip()
     
@@ -3,22 +3,71 @@ Multi-format document parsers for ReasonableRAG
 Supports: PDF, DOCX, TXT, CSV, XLSX, Images
 """
 import os
+import io
+import csv
 import logging
-from typing import Dict, Any, List, Optional
+import multiprocessing
+import subprocess
+import tempfile
+import hashlib
+import threading
+from functools import lru_cache
+from importlib.util import find_spec
+from typing import Dict, Any, List, Optional, Union, Tuple, Iterator, TYPE_CHECKING
 from pathlib import Path
-import fitz  # PyMuPDF
-from docx import Document
-import pandas as pd
-from PIL import Image
-import pytesseract
+from concurrent.futures import ProcessPoolExecutor
+from src.utils.helpers import cache_get, cache_set
+import config
+
+# Format libraries (PyMuPDF, python-docx, pandas, Pillow, pytesseract, ...)
+# are imported inside the parser that needs them, so importing this module
+# stays cheap and a text-only ingest never loads pandas
+if TYPE_CHECKING:
+    import fitz
+    import pandas as pd
+    from PIL import Image
 
 logger = logging.getLogger(__name__)
 
+# Faster tabular readers, used when installed (checked without importing them)
+CSV_ENGINE = 'pyarrow' if find_spec('pyarrow') else 'c'  # multithreaded native CSV parser
+EXCEL_ENGINE = 'calamine' if find_spec('python_calamine') else None  # Rust XLSX/XLS reader for pandas
+
+# In-process Tesseract API, no subprocess per image
+OCR_ENGINE = 'tesserocr' if find_spec('tesserocr') else 'pytesseract'
+
+# A parser source is either a path on disk or an in-memory upload
+Source = Union[str, io.BytesIO]
+
+IMAGE_EXTENSIONS = ('.png', '.jpg', '.jpeg', '.gif', '.bmp', '.tiff')
+
+# Leading bytes every valid file of a binary format starts with
+MAGIC_BYTES = {
+    '.pdf': (b'%PDF',),
+    '.docx': (b'PK\x03\x04',),
+    '.xlsx': (b'PK\x03\x04',),
+    '.png': (b'\x89PNG',),
+    '.jpg': (b'\xff\xd8\xff',),
+    '.jpeg': (b'\xff\xd8\xff',),
+    '.gif': (b'GIF87a', b'GIF89a'),
+    '.bmp': (b'BM',),
+    '.tiff': (b'II*\x00', b'MM\x00*')
+}
+
 
 class DocumentParser:
     """Universal document parser for multiple formats"""
     
-    def __init__(self):
+    def __init__(self, extract_pdf_tables: bool = config.PDF_EXTRACT_TABLES):
+        # Table detection runs a full layout analysis per page; only tabular
+        # formats use tables downstream, so it is off for PDFs by default
+        self.extract_pdf_tables = extract_pdf_tables
+        
+        # One bounded pool extracts pages for every PDF, however many are
+        # parsed at once; created on first use
+        self._pdf_pool: Optional[ProcessPoolExecutor] = None
+        self._pdf_pool_lock = threading.Lock()
+        
         self.parsers = {
             '.pdf': self._parse_pdf,
             '.txt': self._parse_txt,
@@ -35,18 +84,23 @@ class DocumentParser:
             '.tiff': self._parse_image
         }
     
-    def parse(self, file_path: str) -> Dict[str, Any]:
+    def parse(self, file_path: str, data: Optional[bytes] = None,
+              stream: bool = False) -> Dict[str, Any]:
         """
         Parse document and extract content
         
         Args:
-            file_path: Path to document
+            file_path: Path to document (only its name is used when data is given)
+            data: Raw file contents, parsed in memory instead of reading file_path
+            stream: For PDFs, return page texts lazily under 'pages' (with an
+                empty 'text') instead of joining the whole document up front
         
         Returns:
             Dictionary containing:
                 - text: Extracted text content
                 - metadata: Document metadata
-                - tables: Extracted tables (if any)
+                - tables: Extracted tables (if any); CSV and Excel tables hold
+                  the DataFrame itself in 'data' rather than a row list
                 - success: Boolean success flag
                 - error: Error message (if failed)
         """
@@ -62,30 +116,198 @@ class DocumentParser:
             }
         
         try:
-            result = self.parsers[ext](file_path)
-            result['success'] = True
-            result['file_path'] = file_path
-            result['file_name'] = os.path.basename(file_path)
-            result['file_type'] = ext
-            logger.info(f"Successfully parsed {file_path}")
-            return result
+            self._check_signature(file_path, ext, data)
+            
+            source = io.BytesIO(data) if data is not None else file_path
+            parser = self._parse_pdf_streaming if stream and ext == '.pdf' else self.parsers[ext]
+            result = parser(source)
+            return self._finish_result(result, file_path)
         
         except Exception as e:
-            logger.error(f"Error parsing {file_path}: {e}")
-            return {
-                'text': '',
-                'metadata': {},
-                'tables': [],
-                'success': False,
-                'error': str(e),
-                'file_path': file_path
-            }
+            return self._failed_result(file_path, e)
+    
+    def _failed_result(self, file_path: str, error: Exception) -> Dict[str, Any]:
+        """Log a parse failure and build its result"""
+        logger.error(f"Error parsing {file_path}: {error}")
+        return {
+            'text': '',
+            'metadata': {},
+            'tables': [],
+            'success': False,
+            'error': str(error),
+            'file_path': file_path
+        }
+    
+    def _check_signature(self, file_path: str, ext: str, data: Optional[bytes] = None):
+        """
+        Reject empty files and files whose header contradicts their extension
+        
+        Only the first bytes are read, so junk uploads fail before any
+        expensive parser opens them.
+        
+        Raises:
+            ValueError: If the file is empty or has the wrong signature
+        """
+        if data is not None:
+            header = data[:16]
+        else:
+            with open(file_path, 'rb') as f:
+                header = f.read(16)
+        
+        if not header:
+            raise ValueError("File is empty")
+        
+        signatures = MAGIC_BYTES.get(ext)
+        if signatures and not header.startswith(signatures):
+            raise ValueError(f"File content does not match its {ext} extension")
+    
+    def _finish_result(self, result: Dict[str, Any], file_path: str) -> Dict[str, Any]:
+        """Add the common success fields to a format parser's result"""
+        result['success'] = True
+        result['file_path'] = file_path
+        result['file_name'] = os.path.basename(file_path)
+        result['file_type'] = os.path.splitext(file_path)[1].lower()
+        logger.info(f"Successfully parsed {file_path}")
+        return result
+    
+    def parse_images_batch(self, file_paths: List[str],
+                           data: Optional[List[Optional[bytes]]] = None) -> List[Dict[str, Any]]:
+        """
+        OCR several images with a single tesseract process
+        
+        Tesseract reads a list file of images and writes one page per image
+        separated by form feeds, so engine start-up is paid once per batch.
+        Empty or mislabeled images are rejected up front, as parse() would,
+        and images already in the OCR cache are skipped. Falls back to
+        parse() per image if the batch run fails.
+        
+        Args:
+            file_paths: Image paths (only their names are used when data is given)
+            data: Optional in-memory contents for each path
+        
+        Returns:
+            One parse result per image, in input order
+        """
+        data = data or [None] * len(file_paths)
+        
+        if OCR_ENGINE == 'tesserocr':
+            # The in-process engine has no start-up cost to amortize
+            return [self.parse(file_path, file_data) for file_path, file_data in zip(file_paths, data)]
+        
+        # A bad file fails on its own instead of sending the batch to fallback
+        results: List[Optional[Dict[str, Any]]] = [None] * len(file_paths)
+        accepted = []
+        for i, (file_path, file_data) in enumerate(zip(file_paths, data)):
+            try:
+                self._check_signature(file_path, os.path.splitext(file_path)[1].lower(), file_data)
+                accepted.append(i)
+            except Exception as e:
+                results[i] = self._failed_result(file_path, e)
+        
+        if accepted:
+            batch = self._ocr_images_batch([file_paths[i] for i in accepted],
+                                           [data[i] for i in accepted])
+            for i, result in zip(accepted, batch):
+                results[i] = result
+        
+        return results
     
-    def _parse_pdf(self, file_path: str) -> Dict[str, Any]:
+    def _ocr_images_batch(self, file_paths: List[str],
+                          data: List[Optional[bytes]]) -> List[Dict[str, Any]]:
+        """OCR images that passed the signature check in one tesseract run"""
+        from PIL import Image
+        import pytesseract
+        
+        try:
+            with tempfile.TemporaryDirectory() as tmp_dir:
+                texts = [None] * len(file_paths)
+                cache_keys = [None] * len(file_paths)
+                metadata = []
+                to_ocr = []  # (index, image file)
+                
+                for i, (file_path, file_data) in enumerate(zip(file_paths, data)):
+                    image_file = file_path
+                    if file_data is not None:
+                        image_file = os.path.join(tmp_dir, f"{i}{os.path.splitext(file_path)[1]}")
+                        with open(image_file, 'wb') as f:
+                            f.write(file_data)
+                    
+                    with Image.open(image_file) as image:
+                        if getattr(image, 'n_frames', 1) > 1:
+                            raise ValueError(f"{file_path} has multiple frames")
+                        metadata.append({
+                            'size': image.size,
+                            'mode': image.mode,
+                            'format': image.format
+                        })
+                        cache_keys[i] = _ocr_cache_key(image)
+                    
+                    cached = cache_get(config.OCR_CACHE_DIR, cache_keys[i])
+                    if cached is not None:
+                        texts[i] = cached['text']
+                    else:
+                        to_ocr.append((i, os.path.abspath(image_file)))
+                
+                if to_ocr:
+                    list_path = os.path.join(tmp_dir, 'images.txt')
+                    with open(list_path, 'w', encoding='utf-8') as f:
+                        f.write('\n'.join(image_file for _, image_file in to_ocr))
+                    
+                    out_base = os.path.join(tmp_dir, 'ocr')
+                    subprocess.run([pytesseract.pytesseract.tesseract_cmd, list_path, out_base],
+                                   check=True, capture_output=True)
+                    
+                    with open(out_base + '.txt', 'r', encoding='utf-8') as f:
+                        pages = f.read().split('\f')
+                    
+                    # Each image's text is followed by a form feed
+                    if len(pages) - 1 != len(to_ocr):
+                        raise ValueError(f"Expected {len(to_ocr)} OCR pages, got {len(pages) - 1}")
+                    
+                    for (i, _), text in zip(to_ocr, pages):
+                        texts[i] = text
+                        cache_set(config.OCR_CACHE_DIR, cache_keys[i], {'text': text})
+        
+        except Exception as e:
+            logger.warning(f"Batch OCR failed, falling back to per-image OCR: {e}")
+            return [self.parse(file_path, file_data) for file_path, file_data in zip(file_paths, data)]
+        
+        return [
+            self._finish_result({'text': text, 'metadata': meta, 'tables': []}, file_path)
+            for file_path, text, meta in zip(file_paths, texts, metadata)
+        ]
+    
+    def _parse_pdf(self, source: Source) -> Dict[str, Any]:
         """Parse PDF documents"""
-        doc = fitz.open(file_path)
-        text_content = []
-        tables = []
+        result, pages = self._open_pdf_pages(source)
+        
+        # Collect headers and page texts as separate parts so the document is
+        # built by a single join, without formatting a copy of every page first
+        parts = []
+        for page_num, text in pages:
+            parts.extend((f"--- Page {page_num} ---\n", text, "\n\n"))
+        if parts:
+            parts.pop()
+        
+        result['text'] = ''.join(parts)
+        return result
+    
+    def _parse_pdf_streaming(self, source: Source) -> Dict[str, Any]:
+        """
+        Parse a PDF lazily
+        
+        Only the metadata is read up front. 'pages' yields each page's text as
+        it is extracted, so the whole document never has to sit in memory as
+        one string; tables found along the way are appended to 'tables'.
+        """
+        result, pages = self._open_pdf_pages(source)
+        result['pages'] = (f"--- Page {page_num} ---\n{text}" for page_num, text in pages)
+        return result
+    
+    def _open_pdf_pages(self, source: Source) -> Tuple[Dict[str, Any], Iterator[Tuple[int, str]]]:
+        """Read a PDF's metadata and return (result without text, lazy (page number, text) iterator)"""
+        pdf_source = source.getvalue() if isinstance(source, io.BytesIO) else source
+        doc = _open_pdf(pdf_source)
         
         metadata = {
             'pages': len(doc),
@@ -94,71 +316,136 @@ class DocumentParser:
             'subject': doc.metadata.get('subject', '')
         }
         
-        for page_num, page in enumerate(doc):
-            # Extract text
-            text = page.get_text()
-            text_content.append(f"--- Page {page_num + 1} ---\n{text}")
-            
-            # Try to extract tables
+        tables = []
+        result = {'text': '', 'metadata': metadata, 'tables': tables}
+        return result, self._iter_pdf_pages(doc, pdf_source, tables)
+    
+    def _iter_pdf_pages(self, doc: 'fitz.Document', pdf_source: Union[str, bytes],
+                        tables: List[Dict[str, Any]]) -> Iterator[Tuple[int, str]]:
+        """Yield (page number, text) in order, extracting large PDFs in worker processes"""
+        page_count = len(doc)
+        workers = min(config.PDF_WORKERS, page_count)
+        
+        if page_count < config.PDF_PARALLEL_MIN_PAGES or workers <= 1:
             try:
-                page_tables = page.find_tables()
-                if page_tables:
-                    for table in page_tables:
-                        tables.append({
-                            'page': page_num + 1,
-                            'data': table.extract()
-                        })
-            except:
-                pass
+                for page_num in range(page_count):
+                    for text, page_tables in _extract_pdf_pages(doc, page_num, page_num + 1,
+                                                                self.extract_pdf_tables):
+                        tables.extend(page_tables)
+                        yield page_num + 1, text
+            finally:
+                doc.close()
+            return
         
         doc.close()
-        
-        return {
-            'text': '\n\n'.join(text_content),
-            'metadata': metadata,
-            'tables': tables
-        }
+        # MuPDF is not thread-safe, so pages are split into contiguous
+        # ranges and each range is extracted in its own process
+        step = -(-page_count // workers)
+        starts = list(range(0, page_count, step))
+        ends = [min(start + step, page_count) for start in starts]
+        
+        # Workers get a path, not the bytes: an in-memory upload is spooled to
+        # a temporary file once instead of being pickled to every worker
+        spool_path = None
+        if isinstance(pdf_source, bytes):
+            fd, spool_path = tempfile.mkstemp(suffix='.pdf')
+            with os.fdopen(fd, 'wb') as f:
+                f.write(pdf_source)
+            pdf_source = spool_path
+        
+        page_num = 0
+        try:
+            for page_range in self._get_pdf_pool().map(_extract_pdf_page_range,
+                                                       [pdf_source] * len(starts), starts, ends,
+                                                       [self.extract_pdf_tables] * len(starts)):
+                for text, page_tables in page_range:
+                    page_num += 1
+                    tables.extend(page_tables)
+                    yield page_num, text
+        finally:
+            if spool_path is not None:
+                os.remove(spool_path)
+    
+    def _get_pdf_pool(self) -> ProcessPoolExecutor:
+        """The shared PDF page-extraction pool, started on first use"""
+        with self._pdf_pool_lock:
+            if self._pdf_pool is None:
+                # Spawned, not forked: the parser runs on ingest threads, and
+                # forking a multi-threaded process can deadlock the child
+                self._pdf_pool = ProcessPoolExecutor(max_workers=config.PDF_WORKERS,
+                                                     mp_context=multiprocessing.get_context('spawn'))
+            return self._pdf_pool
     
-    def _parse_txt(self, file_path: str) -> Dict[str, Any]:
+    def _parse_txt(self, source: Source) -> Dict[str, Any]:
         """Parse text files"""
         encodings = ['utf-8', 'latin-1', 'cp1252', 'iso-8859-1']
         
-        for encoding in encodings:
-            try:
-                with open(file_path, 'r', encoding=encoding) as f:
-                    text = f.read()
-                
-                return {
-                    'text': text,
-                    'metadata': {'encoding': encoding},
-                    'tables': []
-                }
-            except UnicodeDecodeError:
-                continue
+        if isinstance(source, io.BytesIO):
+            raw = source.getvalue()
+        else:
+            with open(source, 'rb') as f:
+                raw = f.read()
         
-        raise ValueError(f"Could not decode text file with any standard encoding")
+        # UTF-8 is tried first; otherwise sniff the encoding from a sample so
+        # the whole file is decoded once instead of trial by trial
+        text = None
+        try:
+            text = raw.decode('utf-8')
+            encoding = 'utf-8'
+        except UnicodeDecodeError:
+            encodings = [e for e in encodings if e != 'utf-8']
+            detected = _sniff_encoding(raw)
+            if detected:
+                encodings.insert(0, detected)
+            
+            for encoding in encodings:
+                try:
+                    text = raw.decode(encoding)
+                    break
+                except UnicodeDecodeError:
+                    continue
+        
+        if text is None:
+            raise ValueError(f"Could not decode text file with any standard encoding")
+        
+        # Match text-mode reads, which normalize newlines (in one pass)
+        text = io.StringIO(text, newline=None).read()
+        
+        return {
+            'text': text,
+            'metadata': {'encoding': encoding},
+            'tables': []
+        }
     
-    def _parse_docx(self, file_path: str) -> Dict[str, Any]:
+    def _parse_docx(self, source: Source) -> Dict[str, Any]:
         """Parse DOCX/DOC documents"""
-        doc = Document(file_path)
+        from docx import Document
+        from docx.oxml.ns import qn
+        from docx.table import Table
+        from docx.text.paragraph import Paragraph
         
-        # Extract text from paragraphs
-        text_content = []
-        for para in doc.paragraphs:
-            if para.text.strip():
-                text_content.append(para.text)
+        doc = Document(source)
         
-        # Extract tables
+        # Extract paragraph text and tables in one pass over the body
+        text_content = []
         tables = []
-        for table_idx, table in enumerate(doc.tables):
-            table_data = []
-            for row in table.rows:
-                row_data = [cell.text for cell in row.cells]
-                table_data.append(row_data)
-            tables.append({
-                'table_index': table_idx,
-                'data': table_data
-            })
+        para_tag, table_tag = qn('w:p'), qn('w:tbl')
+        for element in doc.element.body.iterchildren():
+            if element.tag == para_tag:
+                para = Paragraph(element, doc)
+                if para.text.strip():
+                    text_content.append(para.text)
+            
+            elif element.tag == table_tag:
+                table = Table(element, doc)
+                table_data = []
+                for row in table.rows:
+                    row_data = [cell.text for cell in row.cells]
+                    table_data.append(row_data)
+                tables.append({
+                    'table_index': len(tables),
+                    'data': table_data
+                })
         
         # Metadata
         core_props = doc.core_properties
@@ -175,7 +462,7 @@ class DocumentParser:
             'tables': tables
         }
     
-    def _parse_csv(self, file_path: str) -> Dict[str, Any]:
+    def _parse_csv(self, source: Source) -> Dict[str, Any]:
         """Parse CSV files"""
         # Try different encodings and delimiters
         encodings = ['utf-8', 'latin-1', 'cp1252']
@@ -185,11 +472,21 @@ class DocumentParser:
         used_encoding = None
         used_delimiter = None
         
-        for encoding in encodings:
+        # Sniff the format from a small sample so the file is normally read once
+        sniffed = self._sniff_csv_format(source, encodings, delimiters)
+        if sniffed:
+            try:
+                candidate = self._read_csv(source, *sniffed)
+                if len(candidate.columns) > 1:
+                    df = candidate
+                    used_encoding, used_delimiter = sniffed
+            except Exception as e:
+                logger.debug(f"Sniffed CSV format {sniffed} failed, probing: {e}")
+        
+        for encoding in encodings if df is None else []:
             for delimiter in delimiters:
                 try:
-                    df = pd.read_csv(file_path, encoding=encoding, 
-                                   delimiter=delimiter, on_bad_lines='skip')
+                    df = self._read_csv(source, encoding, delimiter)
                     if len(df.columns) > 1:  # Valid CSV should have multiple columns
                         used_encoding = encoding
                         used_delimiter = delimiter
@@ -222,19 +519,103 @@ class DocumentParser:
         return {
             'text': '\n\n'.join(text_parts),
             'metadata': metadata,
-            'tables': [{'data': df.values.tolist(), 'columns': df.columns.tolist()}]
+            'tables': [{'data': df, 'columns': df.columns.tolist()}]
         }
     
-    def _parse_excel(self, file_path: str) -> Dict[str, Any]:
+    def _sniff_csv_format(self, source: Source, encodings: List[str], delimiters: List[str],
+                          sample_size: int = 16384) -> Optional[Tuple[str, str]]:
+        """Guess (encoding, delimiter) from the start of a CSV file"""
+        if isinstance(source, io.BytesIO):
+            sample = source.getvalue()[:sample_size]
+        else:
+            with open(source, 'rb') as f:
+                sample = f.read(sample_size)
+        
+        # Cut at the last full line so a multi-byte character is never split
+        if len(sample) == sample_size and b'\n' in sample:
+            sample = sample[:sample.rindex(b'\n')]
+        
+        for encoding in encodings:
+            try:
+                text = sample.decode(encoding)
+            except UnicodeDecodeError:
+                continue
+            
+            try:
+                dialect = csv.Sniffer().sniff(text, delimiters=''.join(delimiters))
+                return encoding, dialect.delimiter
+            except csv.Error:
+                return None
+        
+        return None
+    
+    def _read_csv(self, source: Source, encoding: str, delimiter: str) -> 'pd.DataFrame':
+        """Read a CSV with the fastest available engine, falling back to pandas' C parser"""
+        if CSV_ENGINE == 'pyarrow':
+            try:
+                if isinstance(source, io.BytesIO):
+                    source.seek(0)
+                return self._read_csv_arrow(source, encoding, delimiter)
+            except Exception as e:
+                logger.debug(f"pyarrow CSV reader failed, retrying with C engine: {e}")
+        
+        import pandas as pd
+        
+        if isinstance(source, io.BytesIO):
+            source.seek(0)
+        return pd.read_csv(source, encoding=encoding, 
+                           delimiter=delimiter, on_bad_lines='skip')
+    
+    def _read_csv_arrow(self, source: Source, encoding: str, delimiter: str) -> 'pd.DataFrame':
+        """
+        Read a CSV with pyarrow's native parser
+        
+        Malformed rows are skipped like pandas' on_bad_lines='skip', empty
+        strings count as missing values, and column names are normalized to
+        the names pandas would assign so messy-data detection behaves the same.
+        """
+        import pyarrow.csv as pacsv
+        
+        table = pacsv.read_csv(
+            source,
+            read_options=pacsv.ReadOptions(encoding=encoding, block_size=8 << 20),
+            parse_options=pacsv.ParseOptions(delimiter=delimiter,
+                                             invalid_row_handler=lambda row: 'skip'),
+            convert_options=pacsv.ConvertOptions(strings_can_be_null=True)
+        )
+        
+        names = []
+        seen = {}
+        for i, name in enumerate(table.column_names):
+            name = name or f"Unnamed: {i}"
+            if name in seen:
+                seen[name] += 1
+                name = f"{name}.{seen[name]}"
+            else:
+                seen[name] = 0
+            names.append(name)
+        
+        df = table.rename_columns(names).to_pandas()
+        
+        # Arrow already counted nulls per column in its validity bitmaps, so
+        # messy-data detection can use them instead of rescanning the frame
+        df.attrs['null_fractions'] = [column.null_count / max(1, table.num_rows)
+                                      for column in table.itercolumns()]
+        return df
+    
+    def _parse_excel(self, source: Source) -> Dict[str, Any]:
         """Parse Excel files (XLSX/XLS)"""
-        excel_file = pd.ExcelFile(file_path)
+        import pandas as pd
+        
+        excel_file = pd.ExcelFile(source, engine=EXCEL_ENGINE)
         
         text_parts = []
         all_tables = []
         
-        for sheet_name in excel_file.sheet_names:
-            df = pd.read_excel(file_path, sheet_name=sheet_name)
-            
+        # Read every sheet from the already-open workbook in one call
+        sheets = pd.read_excel(excel_file, sheet_name=None)
+        
+        for sheet_name, df in sheets.items():
             text_parts.append(f"=== Sheet: {sheet_name} ===")
             text_parts.append(f"Rows: {len(df)}, Columns: {len(df.columns)}")
             text_parts.append("Columns: " + ", ".join(df.columns.astype(str).tolist()))
@@ -242,12 +623,12 @@ class DocumentParser:
             
             all_tables.append({
                 'sheet_name': sheet_name,
-                'data': df.values.tolist(),
+                'data': df,
                 'columns': df.columns.tolist()
             })
         
-        # Check for messy data
-        first_df = pd.read_excel(file_path, sheet_name=excel_file.sheet_names[0])
+        # Check for messy data on the first sheet, which was already read above
+        first_df = next(iter(sheets.values()))
         is_messy = self._detect_messy_csv(first_df)
         
         metadata = {
@@ -262,13 +643,21 @@ class DocumentParser:
             'tables': all_tables
         }
     
-    def _parse_image(self, file_path: str) -> Dict[str, Any]:
+    def _parse_image(self, source: Source) -> Dict[str, Any]:
         """Parse images using OCR"""
+        from PIL import Image
+        
         try:
-            image = Image.open(file_path)
+            image = Image.open(source)
             
-            # Perform OCR
-            text = pytesseract.image_to_string(image)
+            # Perform OCR, reusing the result for identical images
+            cache_key = _ocr_cache_key(image)
+            cached = cache_get(config.OCR_CACHE_DIR, cache_key)
+            if cached is not None:
+                text = cached['text']
+            else:
+                text = _ocr_image(image)
+                cache_set(config.OCR_CACHE_DIR, cache_key, {'text': text})
             
             metadata = {
                 'size': image.size,
@@ -283,14 +672,14 @@ class DocumentParser:
             }
         
         except Exception as e:
-            logger.warning(f"OCR failed for {file_path}, returning empty text: {e}")
+            logger.warning(f"OCR failed for {source}, returning empty text: {e}")
             return {
                 'text': '',
                 'metadata': {'error': 'OCR failed'},
                 'tables': []
             }
     
-    def _detect_messy_csv(self, df: pd.DataFrame) -> bool:
+    def _detect_messy_csv(self, df: 'pd.DataFrame') -> bool:
         """
         Detect if CSV/Excel data is messy or unorganized
         
@@ -301,15 +690,20 @@ class DocumentParser:
         - Very few rows
         """
         messy_indicators = 0
+        n_cols = len(df.columns)
         
         # Check for unnamed columns
-        unnamed_cols = sum(1 for col in df.columns if 'Unnamed' in str(col))
-        if unnamed_cols > len(df.columns) * 0.3:  # More than 30% unnamed
+        unnamed_cols = int(df.columns.astype(str).str.startswith('Unnamed').sum())
+        if unnamed_cols > n_cols * 0.3:  # More than 30% unnamed
             messy_indicators += 1
         
-        # Check for columns with mostly null values
-        null_cols = sum(1 for col in df.columns if df[col].isna().sum() > len(df) * 0.5)
-        if null_cols > len(df.columns) * 0.3:
+        # Check for columns with mostly null values (one vectorized pass over
+        # the frame, unless the Arrow reader recorded the fractions already)
+        null_fractions = df.attrs.get('null_fractions')
+        if null_fractions is None:
+            null_fractions = df.isna().mean().to_numpy()
+        null_cols = sum(1 for fraction in null_fractions if fraction > 0.5)
+        if null_cols > n_cols * 0.3:
             messy_indicators += 1
         
         # Check if too few rows
@@ -317,11 +711,123 @@ class DocumentParser:
             messy_indicators += 1
         
         # Check if too many columns
-        if len(df.columns) > 50:
+        if n_cols > 50:
             messy_indicators += 1
         
         return messy_indicators >= 2
 
 
+def _sniff_encoding(raw: bytes, sample_size: int = 65536) -> Optional[str]:
+    """Guess a text encoding from the first bytes of a file"""
+    import charset_normalizer
+    
+    match = charset_normalizer.from_bytes(raw[:sample_size]).best()
+    return match.encoding if match else None
+
+
+_tess_local = threading.local()
+
+
+def _ocr_image(image: 'Image.Image') -> str:
+    """
+    OCR one image, preferring a resident tesserocr engine
+    
+    Each thread keeps its own PyTessBaseAPI handle (they are not thread-safe),
+    so the model is loaded once per worker instead of once per image.
+    Falls back to the pytesseract subprocess if the engine is unavailable.
+    """
+    if OCR_ENGINE == 'tesserocr':
+        try:
+            import tesserocr
+            api = getattr(_tess_local, 'api', None)
+            if api is None:
+                api = _tess_local.api = tesserocr.PyTessBaseAPI()
+            api.SetImage(image)
+            return api.GetUTF8Text()
+        except Exception as e:
+            logger.warning(f"tesserocr failed, falling back to pytesseract: {e}")
+    
+    import pytesseract
+    return pytesseract.image_to_string(image)
+
+
+@lru_cache(maxsize=1)
+def _tesseract_version() -> str:
+    """Tesseract version, looked up once per process (it spawns a subprocess)"""
+    try:
+        if OCR_ENGINE == 'tesserocr':
+            import tesserocr
+            return tesserocr.tesseract_version()
+        import pytesseract
+        return str(pytesseract.get_tesseract_version())
+    except Exception:
+        return 'unknown'
+
+
+def _ocr_cache_key(image: 'Image.Image') -> str:
+    """Cache key from decoded pixels plus the engine version"""
+    digest = hashlib.blake2b(digest_size=16)
+    digest.update(f"{_tesseract_version()}|{image.mode}|{image.size}|".encode())
+    digest.update(image.tobytes())
+    return digest.hexdigest()
+
+
+def _open_pdf(source: Union[str, bytes]) -> 'fitz.Document':
+    """Open a PDF from a path or from raw bytes"""
+    import fitz  # PyMuPDF
+    
+    if isinstance(source, bytes):
+        return fitz.open(stream=source, filetype='pdf')
+    return fitz.open(source)
+
+
+def _extract_pdf_pages(doc: 'fitz.Document', start: int, end: int,
+                       extract_tables: bool = False) -> List[Tuple[str, List[Dict[str, Any]]]]:
+    """Extract (text, tables) for pages start..end-1 of an open PDF"""
+    pages = []
+    
+    for page_num in range(start, end):
+        page = doc[page_num]
+        
+        # Extract text
+        text = page.get_text("text")
+        
+        # Try to extract tables
+        tables = []
+        if not extract_tables:
+            pages.append((text, tables))
+            continue
+        
+        try:
+            page_tables = page.find_tables()
+            if page_tables:
+                for table in page_tables:
+                    tables.append({
+                        'page': page_num + 1,
+                        'data': table.extract()
+                    })
+        except:
+            pass
+        
+        pages.append((text, tables))
+    
+    return pages
+
+
+def _extract_pdf_page_range(source: Union[str, bytes], start: int, end: int,
+                            extract_tables: bool = False) -> List[Tuple[str, List[Dict[str, Any]]]]:
+    """Worker process entry point: open the PDF and extract one page range"""
+    doc = _open_pdf(source)
+    try:
+        return _extract_pdf_pages(doc, start, end, extract_tables)
+    finally:
+        doc.close()
+
+
+def parse_in_process(file_path: str, data: Optional[bytes] = None) -> Dict[str, Any]:
+    """Worker process entry point: parse one (non-streamed) document"""
+    return DocumentParser().parse(file_path, data)
+
+
 logger.info("Document parsers initialized")
 
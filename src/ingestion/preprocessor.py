@@ -3,11 +3,12 @@ Intelligent data preprocessor with LLM reasoning
 Handles messy, unstructured, and unorganized data
 """
 import logging
-from typing import Dict, Any, List, Optional
-import pandas as pd
+import hashlib
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, Any, List, Optional, Iterator, Tuple
 import json
 from src.utils.ollama_client import OllamaClient
-from src.utils.helpers import chunk_text_semantic, clean_text
+from src.utils.helpers import chunk_text_semantic, clean_text, cache_get, cache_set
 import config
 
 logger = logging.getLogger(__name__)
@@ -19,9 +20,127 @@ class IntelligentPreprocessor:
     Especially useful for messy or unstructured data
     """
     
+    # Every preprocessor call uses the same system prompt, and every template
+    # starts with the document excerpt, so calls about the same document share
+    # a long identical prefix that Ollama can reuse from its KV cache
+    SYSTEM_PROMPT = "You are an expert document and data analyst. Provide clear, accurate, well-organized answers."
+    
+    # Prompt templates, defined once and filled in with each document's payload
+    SUMMARY_PROMPT = """Document:
+{text}
+
+Analyze the document above and provide a concise summary that captures:
+1. Main topic/subject
+2. Key points and important information
+3. Type of content (educational, technical, data, narrative, etc.)
+
+Provide a clear, informative summary in 3-5 sentences:"""
+    
+    CONCEPTS_PROMPT = """Document:
+{text}
+
+Extract the main concepts, topics, and keywords from the document above.
+List them as a comma-separated list of single words or short phrases (2-3 words max).
+Focus on the most important and relevant concepts.
+
+Key concepts (comma-separated):"""
+    
+    MESSY_ANALYSIS_PROMPT = """Data:
+{data_preview}
+
+Analyze this messy/unorganized tabular data and describe:
+1. What kind of data this appears to be
+2. What each column might represent (make educated guesses)
+3. Any patterns or structure you can identify
+4. Potential issues with the data organization
+
+Analysis:"""
+    
+    INTERPRETATION_PROMPT = """Data:
+{data_preview}
+
+Analysis:
+{analysis}
+
+Based on this data analysis, provide helpful guidance to a user who doesn't understand this data:
+1. What this data represents in simple terms
+2. How to interpret the information
+3. What questions they could ask about this data
+
+Explanation:"""
+    
+    STRUCTURED_SUMMARY_PROMPT = """Data:
+{data_preview}
+
+Analysis:
+{analysis}
+
+Based on this data analysis, create a structured summary that includes:
+1. What each column likely represents (if identifiable)
+2. Data types and patterns observed
+3. Key insights about the data structure
+4. Suggested questions users might ask about this data
+
+Structured Summary:"""
+    
+    REASONING_PROMPT = """Document:
+{content}
+
+Based on the document above, answer this question with detailed reasoning:
+
+Question: {question}
+
+Provide a thoughtful, well-reasoned answer:"""
+    
     def __init__(self, ollama_client: Optional[OllamaClient] = None):
         self.ollama = ollama_client or OllamaClient()
     
+    def _excerpt(self, text: str, max_chars: int = config.PREPROCESS_CONTEXT_CHARS) -> str:
+        """
+        The leading part of a document that a preprocessor prompt sees
+        
+        Prompts keep their own caps; since every template starts with the
+        excerpt, a shorter one is still a prefix of a longer one
+        """
+        if len(text) > max_chars:
+            return text[:max_chars] + "..."
+        return text
+    
+    def _cached_generate(self, prompt: str, model: Optional[str] = None,
+                         temperature: float = config.LLM_TEMPERATURE,
+                         system: Optional[str] = SYSTEM_PROMPT) -> str:
+        """
+        Generate text, reusing a cached response for an identical request
+        
+        Re-ingesting the same document issues exactly the same prompts, so
+        responses are stored on disk keyed by model, sampling settings and
+        prompt text. A fixed seed keeps the cached output reproducible.
+        
+        Args:
+            prompt: Input prompt
+            model: Model name (defaults to the client's LLM model)
+            temperature: Sampling temperature
+            system: System prompt (the shared preprocessor prompt by default)
+        
+        Returns:
+            Generated text
+        """
+        model = model or self.ollama.llm_model
+        key_source = (f"{model}|{temperature}|{config.LLM_TOP_P}|{config.LLM_TOP_K}|"
+                      f"{config.MAX_TOKENS}|{config.LLM_CACHE_SEED}|{system or ''}|{prompt}")
+        key = hashlib.blake2b(key_source.encode('utf-8'), digest_size=16).hexdigest()
+        
+        cached = cache_get(config.LLM_CACHE_DIR, key)
+        if cached is not None:
+            logger.debug(f"LLM cache hit for {model}")
+            return cached['response']
+        
+        response = self.ollama.generate(prompt, model=model, temperature=temperature,
+                                        system=system, seed=config.LLM_CACHE_SEED)
+        if response:
+            cache_set(config.LLM_CACHE_DIR, key, {'response': response})
+        return response
+    
     def process_document(self, parsed_doc: Dict[str, Any]) -> Dict[str, Any]:
         """
         Process parsed document with intelligent reasoning
@@ -51,19 +170,35 @@ class IntelligentPreprocessor:
     def _process_standard(self, parsed_doc: Dict[str, Any]) -> Dict[str, Any]:
         """Process standard, well-structured documents"""
         text = parsed_doc.get('text', '')
+        base_chunks = None
+        
+        pages = parsed_doc.pop('pages', None)
+        if pages is not None:
+            # Streamed PDF: chunk pages as they arrive and keep only the
+            # opening text the summary and concept prompts need
+            text, base_chunks = self._consume_pages(pages)
+            parsed_doc['text'] = text
         
         if not text or len(text) < 50:
             logger.warning("Document has minimal content")
             return parsed_doc
         
-        # Generate document summary
-        summary = self._generate_summary(text)
-        
-        # Create semantic chunks with context
-        chunks = self._create_enriched_chunks(text, summary, parsed_doc['metadata'])
+        # Computed once; the concepts prompt cuts it down further
+        excerpt = self._excerpt(text)
         
-        # Identify key concepts
-        key_concepts = self._extract_key_concepts(text)
+        # Summary and key concepts are independent LLM roundtrips, so overlap them
+        with ThreadPoolExecutor(max_workers=2) as executor:
+            concepts_future = executor.submit(self._extract_key_concepts, excerpt)
+            
+            # Generate document summary
+            summary = self._generate_summary(excerpt)
+            
+            # Create semantic chunks with context
+            chunks = self._create_enriched_chunks(text, summary, parsed_doc['metadata'],
+                                                  base_chunks)
+            
+            # Identify key concepts
+            key_concepts = concepts_future.result()
         
         # Update document
         parsed_doc['summary'] = summary
@@ -73,6 +208,30 @@ class IntelligentPreprocessor:
         
         return parsed_doc
     
+    def _consume_pages(self, pages: Iterator[str],
+                       head_chars: int = config.PREPROCESS_CONTEXT_CHARS) -> Tuple[str, List[Dict[str, Any]]]:
+        """
+        Chunk streamed page texts in a single pass
+        
+        Returns:
+            (opening text, base chunks); the opening text holds whole pages
+            until it is longer than head_chars, so _excerpt truncates it exactly
+            as it would the full document
+        """
+        head_parts = []
+        head_len = 0
+        
+        def record_head(page_iter: Iterator[str]) -> Iterator[str]:
+            nonlocal head_len
+            for page in page_iter:
+                if head_len <= head_chars:
+                    head_parts.append(page)
+                    head_len += len(page) + 2
+                yield page
+        
+        base_chunks = chunk_text_semantic(record_head(pages))
+        return '\n\n'.join(head_parts), base_chunks
+    
     def _process_messy_tabular(self, parsed_doc: Dict[str, Any]) -> Dict[str, Any]:
         """
         Process messy CSV/Excel data with LLM assistance.
@@ -87,17 +246,21 @@ class IntelligentPreprocessor:
         if not tables:
             return self._process_standard(parsed_doc)
         
-        # Get more context for analysis (up to 10k chars for better understanding)
-        analysis_text = text[:10000] if len(text) > 10000 else text
+        # One excerpt feeds all three prompts so they share a prefix (the
+        # structured summary sees only its start)
+        analysis_text = self._excerpt(text)
         
         # Analyze the structure with LLM
         analysis = self._analyze_messy_data(analysis_text)
         
-        # Generate helpful interpretation
-        interpretation = self._interpret_data_structure(analysis_text, analysis)
-        
-        # Try to create a structured representation (if possible)
-        structured_summary = self._create_structured_summary(text[:5000], analysis)
+        # Interpretation and structured summary both depend only on the analysis
+        with ThreadPoolExecutor(max_workers=2) as executor:
+            # Try to create a structured representation (if possible)
+            summary_future = executor.submit(self._create_structured_summary, analysis_text, analysis)
+            
+            # Generate helpful interpretation
+            interpretation = self._interpret_data_structure(analysis_text, analysis)
+            structured_summary = summary_future.result()
         
         # Create enriched chunks WITH analysis embedded in text
         chunks = self._create_tabular_chunks(text, analysis, interpretation, structured_summary)
@@ -114,47 +277,23 @@ class IntelligentPreprocessor:
         return parsed_doc
     
     def _generate_summary(self, text: str, max_length: int = 2000) -> str:
-        """Generate concise summary of document"""
-        # Truncate if too long
-        if len(text) > 10000:
-            text = text[:10000] + "..."
-        
-        prompt = f"""Analyze the following document and provide a concise summary that captures:
-1. Main topic/subject
-2. Key points and important information
-3. Type of content (educational, technical, data, narrative, etc.)
-
-Document:
-{text}
-
-Provide a clear, informative summary in 3-5 sentences:"""
+        """Generate concise summary of a document excerpt"""
+        prompt = self.SUMMARY_PROMPT.format(text=text)
         
         try:
-            system_prompt = "You are an expert document analyst. Provide clear, accurate summaries."
-            summary = self.ollama.generate(prompt, system=system_prompt, 
-                                          model=config.FAST_LLM_MODEL)
+            summary = self._cached_generate(prompt, model=config.FAST_LLM_MODEL)
             return summary.strip()
         except Exception as e:
             logger.error(f"Error generating summary: {e}")
             return "Summary generation failed."
     
     def _extract_key_concepts(self, text: str) -> List[str]:
-        """Extract key concepts and topics from text"""
-        if len(text) > 8000:
-            text = text[:8000]
-        
-        prompt = f"""Extract the main concepts, topics, and keywords from this text.
-List them as a comma-separated list of single words or short phrases (2-3 words max).
-Focus on the most important and relevant concepts.
-
-Text:
-{text}
-
-Key concepts (comma-separated):"""
+        """Extract key concepts and topics from a document excerpt"""
+        prompt = self.CONCEPTS_PROMPT.format(text=self._excerpt(text, 8000))
         
         try:
-            concepts_text = self.ollama.generate(prompt, model=config.FAST_LLM_MODEL,
-                                                temperature=0.3)
+            concepts_text = self._cached_generate(prompt, model=config.FAST_LLM_MODEL,
+                                                  temperature=0.3)
             # Parse comma-separated concepts
             concepts = [c.strip() for c in concepts_text.split(',') if c.strip()]
             return concepts[:20]  # Top 20 concepts
@@ -164,19 +303,10 @@ Key concepts (comma-separated):"""
     
     def _analyze_messy_data(self, data_preview: str) -> str:
         """Analyze messy tabular data structure"""
-        prompt = f"""Analyze this messy/unorganized tabular data and describe:
-1. What kind of data this appears to be
-2. What each column might represent (make educated guesses)
-3. Any patterns or structure you can identify
-4. Potential issues with the data organization
-
-Data:
-{data_preview}
-
-Analysis:"""
+        prompt = self.MESSY_ANALYSIS_PROMPT.format(data_preview=data_preview)
         
         try:
-            analysis = self.ollama.generate(prompt, temperature=0.2)
+            analysis = self._cached_generate(prompt, temperature=0.2)
             return analysis.strip()
         except Exception as e:
             logger.error(f"Error analyzing messy data: {e}")
@@ -184,33 +314,22 @@ Analysis:"""
     
     def _interpret_data_structure(self, data_preview: str, analysis: str) -> str:
         """Generate helpful interpretation for user"""
-        prompt = f"""Based on this data analysis, provide helpful guidance to a user who doesn't understand this data:
-
-Data Preview:
-{data_preview}
-
-Analysis:
-{analysis}
-
-Provide user-friendly explanation:
-1. What this data represents in simple terms
-2. How to interpret the information
-3. What questions they could ask about this data
-
-Explanation:"""
+        prompt = self.INTERPRETATION_PROMPT.format(data_preview=data_preview, analysis=analysis)
         
         try:
-            interpretation = self.ollama.generate(prompt, temperature=0.3)
+            interpretation = self._cached_generate(prompt, temperature=0.3)
             return interpretation.strip()
         except Exception as e:
             logger.error(f"Error generating interpretation: {e}")
             return "Interpretation failed."
     
     def _create_enriched_chunks(self, text: str, summary: str, 
-                               metadata: Dict[str, Any]) -> List[Dict[str, Any]]:
+                               metadata: Dict[str, Any],
+                               base_chunks: Optional[List[Dict[str, Any]]] = None) -> List[Dict[str, Any]]:
         """Create semantic chunks with rich context"""
-        # Use semantic chunking
-        base_chunks = chunk_text_semantic(text)
+        # Use semantic chunking (unless the text was already chunked while streaming)
+        if base_chunks is None:
+            base_chunks = chunk_text_semantic(text)
         
         # Enrich each chunk with context
         enriched_chunks = []
@@ -235,22 +354,11 @@ Explanation:"""
         """
         Create a structured summary of the data that can be easily searched
         """
-        prompt = f"""Based on this data analysis, create a structured summary that includes:
-1. What each column likely represents (if identifiable)
-2. Data types and patterns observed
-3. Key insights about the data structure
-4. Suggested questions users might ask about this data
-
-Data Preview:
-{text[:3000]}
-
-Analysis:
-{analysis}
-
-Structured Summary:"""
+        prompt = self.STRUCTURED_SUMMARY_PROMPT.format(data_preview=self._excerpt(text, 3000),
+                                                       analysis=analysis)
         
         try:
-            summary = self.ollama.generate(prompt, model=config.FAST_LLM_MODEL, temperature=0.2)
+            summary = self._cached_generate(prompt, model=config.FAST_LLM_MODEL, temperature=0.2)
             return summary.strip()
         except Exception as e:
             logger.error(f"Error creating structured summary: {e}")
@@ -260,11 +368,12 @@ Structured Summary:"""
                               interpretation: str, structured_summary: str = "") -> List[Dict[str, Any]]:
         """
         Create chunks for tabular data with LLM insights.
-        IMPORTANT: Includes analysis/interpretation in the text field so it's embedded
-        and searchable in vector store.
+        The full analysis is embedded once, in a dedicated analysis chunk; data
+        chunks reference it by ID and only carry a short note, so the analysis
+        is not re-embedded with every slice of the table.
         """
         # Split text into manageable chunks
-        base_chunks = chunk_text_semantic(text, chunk_size=1200)  # Reduced to fit analysis
+        base_chunks = chunk_text_semantic(text, chunk_size=1200)
         
         # Create a comprehensive metadata chunk with analysis/interpretation (always searchable)
         metadata_text = f"""DATA STRUCTURE ANALYSIS AND INTERPRETATION:
@@ -285,12 +394,15 @@ Structured Summary:"""
 
 This data has been analyzed and interpreted. The analysis above describes the structure, meaning, and patterns in the data."""
         
+        analysis_chunk_id = hashlib.blake2b(metadata_text.encode('utf-8'), digest_size=8).hexdigest()
+        
         metadata_chunk = {
             'text': metadata_text,
             'chunk_index': -1,  # Special index for metadata chunk
             'context': {
                 'data_type': 'tabular',
                 'chunk_type': 'analysis_metadata',
+                'chunk_id': analysis_chunk_id,
                 'analysis': analysis,
                 'interpretation': interpretation,
                 'structured_summary': structured_summary
@@ -300,24 +412,20 @@ This data has been analyzed and interpreted. The analysis above describes the st
         
         enriched_chunks = [metadata_chunk]  # Add analysis chunk first
         
-        # Enrich each data chunk with analysis context
+        # Data chunks point at the analysis chunk instead of repeating it
         for idx, chunk_data in enumerate(base_chunks):
-            # Prepend analysis context to make it searchable
-            enriched_text = f"""DATA CONTEXT (from AI analysis):
-{analysis}
-
-ACTUAL DATA:
+            enriched_text = f"""TABULAR DATA ({idx + 1} of {len(base_chunks)}):
 {chunk_data['text']}
 
 NOTE: {interpretation[:200]}"""
             
             enriched_chunk = {
-                'text': enriched_text,  # Include analysis in embedded text!
+                'text': enriched_text,
                 'chunk_index': idx,
                 'context': {
                     'data_type': 'tabular',
-                    'analysis': analysis,
-                    'interpretation': interpretation,
+                    'analysis_chunk_id': analysis_chunk_id,
+                    'analysis_summary': analysis[:100],
                     'chunk_position': f"{idx + 1} of {len(base_chunks)}",
                     'has_analysis_context': True
                 },
@@ -339,17 +447,10 @@ NOTE: {interpretation[:200]}"""
         Returns:
             Reasoned response
         """
-        prompt = f"""Based on the following content, answer this question with detailed reasoning:
-
-Content:
-{text[:5000]}
-
-Question: {question}
-
-Provide a thoughtful, well-reasoned answer:"""
+        prompt = self.REASONING_PROMPT.format(content=self._excerpt(text, 5000), question=question)
         
         try:
-            response = self.ollama.generate(prompt, temperature=0.3)
+            response = self._cached_generate(prompt, temperature=0.3)
             return response.strip()
         except Exception as e:
             logger.error(f"Error reasoning about content: {e}")
@@ -1,17 +1,24 @@
 """
 Main RAG pipeline orchestrating all components
 """
+import asyncio
+import atexit
 import logging
+import multiprocessing
 import os
-from typing import List, Dict, Any, Optional
+import threading
+import time
+from typing import List, Dict, Any, Optional, Callable, Iterator, AsyncIterator
 from pathlib import Path
-from src.ingestion.parsers import DocumentParser
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor, as_completed
+from src.ingestion.parsers import DocumentParser, IMAGE_EXTENSIONS, OCR_ENGINE, parse_in_process
 from src.ingestion.preprocessor import IntelligentPreprocessor
 from src.vectorstore.faiss_store import FAISSVectorStore
 from src.retrieval.retriever import Retriever
 from src.generation.generator import Generator
 from src.utils.ollama_client import OllamaClient
-from src.utils.helpers import get_file_hash, save_metadata, load_metadata
+from src.utils.helpers import (get_file_hash, get_bytes_hash, save_metadata, load_metadata,
+                               HASH_ENGINE, HASH_PREFIX)
 import config
 
 logger = logging.getLogger(__name__)
@@ -23,15 +30,60 @@ class RAGPipeline:
     """
     
     def __init__(self):
+        config.ensure_dirs()
+        
         self.ollama = OllamaClient()
         self.parser = DocumentParser()
         self.preprocessor = IntelligentPreprocessor(self.ollama)
         self.vector_store = FAISSVectorStore(self.ollama)
-        self.retriever = Retriever(self.vector_store, self.ollama)
         self.generator = Generator(self.ollama)
         
         # Track processed documents
         self.processed_docs = load_metadata()
+        
+        # One pipeline serves every app session. Ingests, deletes and saves
+        # take the write lock in turn (reentrant, as ingest_bytes goes through
+        # ingest_documents); the store lock is held only while the vector
+        # store changes in memory or is searched, so a search waits for a
+        # batch add, not for a whole ingest, and query embedding and
+        # reranking run outside it
+        self._write_lock = threading.RLock()
+        self._store_lock = threading.Lock()
+        self.retriever = Retriever(self.vector_store, self.ollama, store_lock=self._store_lock)
+        
+        # Single-file ingests only save every VECTOR_SAVE_EVERY documents (or
+        # VECTOR_SAVE_INTERVAL seconds); anything still unsaved is written at exit
+        self._unsaved_docs = 0
+        self._last_save = time.time()
+        atexit.register(self.flush)
+    
+    def warmup(self):
+        """
+        Load the embedding and generation models into Ollama
+        
+        Also evaluates the system prompt so the first query reuses the cached
+        prefix. Failures are logged and ignored.
+        """
+        self.ollama.warmup_embeddings()
+        self.ollama.warmup(system=self.generator.SYSTEM_PROMPT)
+    
+    def start_keepalive(self, interval: float = config.OLLAMA_KEEPALIVE_INTERVAL):
+        """
+        Re-run warmup every interval seconds on a daemon timer
+        
+        Keeps the models loaded through idle periods longer than
+        OLLAMA_KEEP_ALIVE. Does nothing when interval is 0.
+        """
+        if interval <= 0:
+            return
+        
+        def ping():
+            self.warmup()
+            self.start_keepalive(interval)
+        
+        timer = threading.Timer(interval, ping)
+        timer.daemon = True
+        timer.start()
     
     def check_ollama(self) -> bool:
         """Check if Ollama is available"""
@@ -48,21 +100,267 @@ class RAGPipeline:
         Returns:
             Processing result with status and metadata
         """
+        with self._write_lock:
+            prepared = self._prepare_document(file_path)
+            if prepared['status'] != 'prepared':
+                return prepared
+            
+            processed_doc = prepared['processed_doc']
+            if not save_to_store or 'chunks' not in processed_doc:
+                return {
+                    'status': 'processed_no_store',
+                    'file_path': file_path,
+                    'processed_doc': processed_doc
+                }
+            
+            return self._store_documents([prepared], save=self._save_due(1))[0]
+    
+    def ingest_bytes(self, file_name: str, data: bytes) -> Dict[str, Any]:
+        """
+        Ingest an uploaded document from memory
+        
+        The contents are parsed straight from memory and only written to
+        UPLOAD_DIR once parsing succeeds, so the file is not read back from disk.
+        
+        Args:
+            file_name: Original file name (used for format detection)
+            data: Raw file contents
+        
+        Returns:
+            Processing result with status and metadata
+        """
+        return self.ingest_documents([os.path.join(config.UPLOAD_DIR, file_name)],
+                                     file_data=[data])[0]
+    
+    def ingest_documents(self, file_paths: List[str],
+                         progress_callback: Optional[Callable[[int, int, str], None]] = None,
+                         file_data: Optional[List[bytes]] = None) -> List[Dict[str, Any]]:
+        """
+        Ingest several documents, embedding chunks while later files are still parsed
+        
+        Documents are parsed and preprocessed on a thread pool. As they finish,
+        this thread embeds and adds their chunks to the vector store in batches
+        of about INGEST_STORE_BATCH chunks (in upload order), and the store is
+        saved once at the end of the batch.
+        
+        Args:
+            file_paths: Paths to documents
+            progress_callback: Called from the calling thread as (done, total, file_path)
+                after each document finishes parsing
+            file_data: In-memory contents for each path; each file is written
+                to its path only after it parses successfully
+        
+        Returns:
+            One processing result per file, in input order
+        """
+        with self._write_lock:
+            results: List[Optional[Dict[str, Any]]] = [None] * len(file_paths)
+            jobs = []
+            batch_hashes = set()
+            done = 0
+            
+            # Hash up front so duplicates (stored or earlier in this batch) are
+            # skipped before any worker parses them
+            for i, file_path in enumerate(file_paths):
+                data = file_data[i] if file_data is not None else None
+                file_hash = self._document_hash(file_path, data)
+                
+                if self._is_processed(file_path, data, file_hash) or file_hash in batch_hashes:
+                    results[i] = self._already_processed(file_path)
+                    done += 1
+                    if progress_callback:
+                        progress_callback(done, len(file_paths), file_path)
+                else:
+                    batch_hashes.add(file_hash)
+                    jobs.append((i, file_path, data, file_hash))
+            
+            # OCR all images in one tesseract run instead of one process each
+            # (an in-process tesserocr engine instead OCRs them on the thread pool)
+            image_jobs = [job for job in jobs if os.path.splitext(job[1])[1].lower() in IMAGE_EXTENSIONS]
+            parsed_images = {}
+            if len(image_jobs) > 1 and OCR_ENGINE != 'tesserocr':
+                parsed = self.parser.parse_images_batch([job[1] for job in image_jobs],
+                                                        [job[2] for job in image_jobs])
+                parsed_images = {job[0]: parsed_doc for job, parsed_doc in zip(image_jobs, parsed)}
+            
+            # Parse CPU-bound formats in worker processes, outside the GIL (PDFs
+            # already extract pages in processes of their own, images are OCRed above)
+            process_jobs = [job for job in jobs
+                            if os.path.splitext(job[1])[1].lower() not in IMAGE_EXTENSIONS + ('.pdf',)]
+            parse_pool = None
+            parse_futures = {}
+            if config.PARSE_PROCESSES > 0 and len(process_jobs) > 1:
+                # Spawned, as forking this multi-threaded process can deadlock
+                parse_pool = ProcessPoolExecutor(max_workers=min(config.PARSE_PROCESSES, len(process_jobs)),
+                                                 mp_context=multiprocessing.get_context('spawn'))
+                parse_futures = {i: parse_pool.submit(parse_in_process, file_path, data)
+                                 for i, file_path, data, _ in process_jobs}
+            
+            def prepare(i: int, file_path: str, data: Optional[bytes], file_hash: str) -> Dict[str, Any]:
+                parsed_doc = parsed_images.get(i)
+                if i in parse_futures:
+                    try:
+                        parsed_doc = parse_futures[i].result()
+                    except Exception as e:
+                        # e.g. a crashed worker; parse on this thread instead
+                        logger.warning(f"Parse worker failed for {file_path}: {e}")
+                return self._prepare_document(file_path, data, file_hash, parsed_doc)
+            
+            # Parse and preprocess in parallel; only this thread writes the
+            # vector store, and only under the store lock, since FAISS adds are
+            # not thread-safe
+            if jobs:
+                order = [job[0] for job in jobs]
+                finished: Dict[int, Optional[Dict[str, Any]]] = {}
+                next_job = 0
+                batch: List[Any] = []
+                batch_chunks = 0
+                start_time = time.time()
+                
+                try:
+                    with ThreadPoolExecutor(max_workers=min(config.INGEST_WORKERS, len(jobs))) as executor:
+                        futures = {
+                            executor.submit(prepare, i, file_path, data, file_hash): (i, file_path)
+                            for i, file_path, data, file_hash in jobs
+                        }
+                        for prepared_count, future in enumerate(as_completed(futures), 1):
+                            i, file_path = futures[future]
+                            prepared = future.result()
+                        
+                            if prepared['status'] == 'prepared' and 'chunks' not in prepared['processed_doc']:
+                                prepared = {
+                                    'status': 'processed_no_store',
+                                    'file_path': file_path,
+                                    'processed_doc': prepared['processed_doc']
+                                }
+                        
+                            if prepared['status'] == 'prepared':
+                                finished[i] = prepared
+                            else:
+                                results[i] = prepared
+                                finished[i] = None
+                        
+                            done += 1
+                            if progress_callback:
+                                progress_callback(done, len(file_paths), file_path)
+                        
+                            elapsed = time.time() - start_time
+                            eta = elapsed / prepared_count * (len(jobs) - prepared_count)
+                            logger.info(f"Prepared {prepared_count}/{len(jobs)} documents "
+                                        f"({elapsed:.0f}s elapsed, ETA {eta:.0f}s)")
+                        
+                            # Queue documents for storage in upload order
+                            while next_job < len(order) and order[next_job] in finished:
+                                ready = finished.pop(order[next_job])
+                                if ready is not None:
+                                    batch.append((order[next_job], ready))
+                                    batch_chunks += len(ready['processed_doc']['chunks'])
+                                next_job += 1
+                        
+                            # Embed a full batch while the workers keep parsing
+                            if batch_chunks >= config.INGEST_STORE_BATCH:
+                                self._store_batch(batch, results, save=False)
+                                batch = []
+                                batch_chunks = 0
+                finally:
+                    # Also on errors, so worker processes holding upload
+                    # bytes do not outlive the ingest
+                    if parse_pool is not None:
+                        parse_pool.shutdown(cancel_futures=True)
+                
+                # Store the remainder and save everything not yet on disk once
+                if batch or self._unsaved_docs:
+                    self._store_batch(batch, results, save=True)
+            
+            return results
+    
+    def flush(self):
+        """Write the vector store and document metadata if any ingest is unsaved"""
+        with self._write_lock:
+            if not self._unsaved_docs:
+                return
+            
+            self.vector_store.flush()
+            save_metadata(self.processed_docs)
+            self._unsaved_docs = 0
+            self._last_save = time.time()
+    
+    def _save_due(self, new_docs: int) -> bool:
+        """Whether storing new_docs more documents should also save everything"""
+        return (self._unsaved_docs + new_docs >= config.VECTOR_SAVE_EVERY
+                or time.time() - self._last_save >= config.VECTOR_SAVE_INTERVAL)
+    
+    def _store_batch(self, batch: List[Any], results: List[Optional[Dict[str, Any]]],
+                     save: bool):
+        """Store (index, prepared) pairs and put each result at its index"""
+        stored = self._store_documents([prepared for _, prepared in batch], save=save)
+        for (i, _), result in zip(batch, stored):
+            results[i] = result
+    
+    def _document_hash(self, file_path: str, data: Optional[bytes] = None) -> str:
+        """Content hash used as the processed_docs key"""
+        return get_bytes_hash(data) if data is not None else get_file_hash(file_path)
+    
+    def _is_processed(self, file_path: str, data: Optional[bytes], file_hash: str) -> bool:
+        """
+        Check whether a document's content is already stored
+        
+        Metadata written before BLAKE3 keys were introduced is keyed by plain
+        SHA-256, so while any such keys remain the legacy hash is also checked.
+        """
+        if file_hash in self.processed_docs:
+            return True
+        
+        if HASH_ENGINE != 'blake3':
+            return False
+        
+        if not any(not key.startswith(HASH_PREFIX) for key in self.processed_docs):
+            return False
+        
+        legacy_hash = (get_bytes_hash(data, legacy=True) if data is not None
+                       else get_file_hash(file_path, legacy=True))
+        return legacy_hash in self.processed_docs
+    
+    def _already_processed(self, file_path: str) -> Dict[str, Any]:
+        """Result for a document whose content is already stored"""
+        logger.info(f"Document already processed: {file_path}")
+        return {
+            'status': 'already_processed',
+            'file_path': file_path,
+            'message': 'Document already in database'
+        }
+    
+    def _prepare_document(self, file_path: str, data: Optional[bytes] = None,
+                          file_hash: Optional[str] = None,
+                          parsed_doc: Optional[Dict[str, Any]] = None) -> Dict[str, Any]:
+        """
+        Parse and preprocess a document without touching the vector store
+        
+        The content hash is checked before anything is parsed or written, so
+        duplicates cost only one hashing pass.
+        
+        Args:
+            file_path: Path to document
+            data: In-memory contents, written to file_path after a successful parse
+            file_hash: Hash the caller already computed and checked for duplicates
+            parsed_doc: Parser output the caller already produced (skips parsing)
+        
+        Returns:
+            Result with status 'prepared' (plus file_hash and processed_doc),
+            'already_processed' or 'error'
+        """
         logger.info(f"Ingesting document: {file_path}")
         
         # Check if already processed
-        file_hash = get_file_hash(file_path)
-        if file_hash in self.processed_docs:
-            logger.info(f"Document already processed: {file_path}")
-            return {
-                'status': 'already_processed',
-                'file_path': file_path,
-                'message': 'Document already in database'
-            }
+        if file_hash is None:
+            file_hash = self._document_hash(file_path, data)
+            if self._is_processed(file_path, data, file_hash):
+                return self._already_processed(file_path)
         
         try:
             # Step 1: Parse document
-            parsed_doc = self.parser.parse(file_path)
+            if parsed_doc is None:
+                parsed_doc = self.parser.parse(file_path, data, stream=True)
             
             if not parsed_doc['success']:
                 return {
@@ -71,44 +369,18 @@ class RAGPipeline:
                     'error': parsed_doc.get('error', 'Unknown error')
                 }
             
+            if data is not None:
+                self._persist_upload(file_path, data)
+            
             # Step 2: Intelligent preprocessing with LLM reasoning
             processed_doc = self.preprocessor.process_document(parsed_doc)
             
-            # Step 3: Add to vector store
-            if save_to_store and 'chunks' in processed_doc:
-                chunks_added = self.vector_store.add_documents(processed_doc['chunks'])
-                
-                # Save vector store
-                self.vector_store.save()
-                
-                # Track processed document
-                self.processed_docs[file_hash] = {
-                    'file_path': file_path,
-                    'file_name': os.path.basename(file_path),
-                    'chunks': chunks_added,
-                    'summary': processed_doc.get('summary', ''),
-                    'file_type': processed_doc.get('file_type', ''),
-                    'is_messy': processed_doc.get('metadata', {}).get('is_messy', False)
-                }
-                save_metadata(self.processed_docs)
-                
-                logger.info(f"Successfully ingested {file_path}: {chunks_added} chunks")
-                
-                return {
-                    'status': 'success',
-                    'file_path': file_path,
-                    'chunks_added': chunks_added,
-                    'summary': processed_doc.get('summary', ''),
-                    'is_messy': processed_doc.get('metadata', {}).get('is_messy', False),
-                    'data_analysis': processed_doc.get('data_analysis', ''),
-                    'interpretation': processed_doc.get('interpretation', '')
-                }
-            else:
-                return {
-                    'status': 'processed_no_store',
-                    'file_path': file_path,
-                    'processed_doc': processed_doc
-                }
+            return {
+                'status': 'prepared',
+                'file_path': file_path,
+                'file_hash': file_hash,
+                'processed_doc': processed_doc
+            }
         
         except Exception as e:
             logger.error(f"Error ingesting document {file_path}: {e}")
@@ -118,8 +390,84 @@ class RAGPipeline:
                 'error': str(e)
             }
     
+    def _persist_upload(self, file_path: str, data: bytes):
+        """Keep a copy of an in-memory upload for the document library"""
+        with open(file_path, 'wb') as f:
+            f.write(data)
+    
+    def _store_documents(self, prepared_docs: List[Dict[str, Any]],
+                         save: bool = True) -> List[Dict[str, Any]]:
+        """
+        Embed and store the chunks of prepared documents in one pass
+        
+        Args:
+            prepared_docs: Results from _prepare_document with status 'prepared'
+            save: Write the vector store and metadata to disk afterwards;
+                otherwise they stay unsaved until a later save or flush()
+        
+        Returns:
+            One ingestion result per prepared document
+        """
+        all_chunks = []
+        for prepared in prepared_docs:
+            all_chunks.extend(prepared['processed_doc']['chunks'])
+        
+        try:
+            # Step 3: Add to vector store
+            with self._store_lock:
+                self.vector_store.add_documents(all_chunks)
+            
+            # Save vector store
+            if save:
+                self.vector_store.save()
+        
+        except Exception as e:
+            logger.error(f"Error storing {len(prepared_docs)} document(s): {e}")
+            return [{
+                'status': 'error',
+                'file_path': prepared['file_path'],
+                'error': str(e)
+            } for prepared in prepared_docs]
+        
+        results = []
+        for prepared in prepared_docs:
+            file_path = prepared['file_path']
+            processed_doc = prepared['processed_doc']
+            chunks_added = len(processed_doc['chunks'])
+            
+            # Track processed document
+            self.processed_docs[prepared['file_hash']] = {
+                'file_path': file_path,
+                'file_name': os.path.basename(file_path),
+                'chunks': chunks_added,
+                'summary': processed_doc.get('summary', ''),
+                'file_type': processed_doc.get('file_type', ''),
+                'is_messy': processed_doc.get('metadata', {}).get('is_messy', False)
+            }
+            
+            logger.info(f"Successfully ingested {file_path}: {chunks_added} chunks")
+            
+            results.append({
+                'status': 'success',
+                'file_path': file_path,
+                'chunks_added': chunks_added,
+                'summary': processed_doc.get('summary', ''),
+                'is_messy': processed_doc.get('metadata', {}).get('is_messy', False),
+                'data_analysis': processed_doc.get('data_analysis', ''),
+                'interpretation': processed_doc.get('interpretation', '')
+            })
+        
+        if save:
+            save_metadata(self.processed_docs)
+            self._unsaved_docs = 0
+            self._last_save = time.time()
+        else:
+            self._unsaved_docs += len(prepared_docs)
+        
+        return results
+    
     def query(self, question: str, top_k: int = config.TOP_K_RETRIEVAL,
-              use_rerank: bool = False) -> Dict[str, Any]:
+              use_rerank: bool = False, model: Optional[str] = None) -> Dict[str, Any]:
         """
         Query the RAG system
         
@@ -127,6 +475,7 @@ class RAGPipeline:
             question: User question
             top_k: Number of chunks to retrieve
             use_rerank: Whether to use LLM reranking
+            model: LLM model for generation (defaults to the client's model)
         
         Returns:
             Answer and relevant context
@@ -135,29 +484,15 @@ class RAGPipeline:
         
         try:
             # Retrieve relevant context
-            if use_rerank:
-                context_chunks = self.retriever.retrieve_with_rerank(question, top_k=top_k * 2)
-            else:
-                context_chunks = self.retriever.retrieve(question, top_k=top_k)
+            context_chunks = self.retrieve_context(question, top_k=top_k, use_rerank=use_rerank)
             
             # Generate response
-            answer = self.generator.generate_educational_response(question, context_chunks)
-            
-            # Format sources
-            sources = []
-            for chunk in context_chunks:
-                metadata = chunk.get('metadata', {})
-                context = metadata.get('context', {})
-                sources.append({
-                    'text': chunk['text'][:200] + '...',
-                    'score': chunk['score'],
-                    'file_name': context.get('file_name', 'Unknown'),
-                    'chunk_position': context.get('chunk_position', '')
-                })
+            answer = self.generator.generate_educational_response(question, context_chunks,
+                                                                  model=model)
             
             return {
                 'answer': answer,
-                'sources': sources,
+                'sources': self.format_sources(context_chunks),
                 'num_chunks_used': len(context_chunks),
                 'success': True
             }
@@ -172,26 +507,94 @@ class RAGPipeline:
                 'error': str(e)
             }
     
-    def query_stream(self, question: str, top_k: int = config.TOP_K_RETRIEVAL):
+    def retrieve_context(self, question: str, top_k: int = config.TOP_K_RETRIEVAL,
+                         use_rerank: bool = False) -> List[Dict[str, Any]]:
+        """
+        Retrieve context chunks for a question
+        
+        Args:
+            question: User question
+            top_k: Number of chunks to retrieve
+            use_rerank: Whether to use LLM reranking
+        
+        Returns:
+            Relevant chunks with scores and metadata
+        """
+        if use_rerank:
+            return self.retriever.retrieve_with_rerank(question, top_k=top_k * 2)
+        return self.retriever.retrieve(question, top_k=top_k)
+    
+    def format_sources(self, context_chunks: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+        """Format retrieved chunks as source entries for display"""
+        sources = []
+        for chunk in context_chunks:
+            metadata = chunk.get('metadata', {})
+            context = metadata.get('context', {})
+            sources.append({
+                'text': metadata.get('text_preview') or chunk['text'][:200] + '...',
+                'score': chunk['score'],
+                'file_name': context.get('file_name', 'Unknown'),
+                'chunk_position': context.get('chunk_position', '')
+            })
+        return sources
+    
+    def query_stream(self, question: str, top_k: int = config.TOP_K_RETRIEVAL,
+                     use_rerank: bool = False, model: Optional[str] = None,
+                     context_chunks: Optional[List[Dict[str, Any]]] = None) -> Iterator[str]:
         """
         Query with streaming response
         
+        Args:
+            question: User question
+            top_k: Number of chunks to retrieve
+            use_rerank: Whether to use LLM reranking
+            model: LLM model for generation (defaults to the client's model)
+            context_chunks: Already retrieved chunks (skips retrieval)
+        
         Yields:
             Response chunks as they are generated
         """
         # Retrieve context
-        context_chunks = self.retriever.retrieve(question, top_k=top_k)
+        if context_chunks is None:
+            context_chunks = self.retrieve_context(question, top_k=top_k, use_rerank=use_rerank)
         
         # Stream response
-        for chunk in self.generator.generate_stream(question, context_chunks):
+        for chunk in self.generator.generate_stream(question, context_chunks, model=model):
             yield chunk
     
-    def analyze_messy_data(self, file_path: str) -> Dict[str, Any]:
+    async def aquery_stream(self, question: str, top_k: int = config.TOP_K_RETRIEVAL,
+                            use_rerank: bool = False, model: Optional[str] = None,
+                            context_chunks: Optional[List[Dict[str, Any]]] = None) -> AsyncIterator[str]:
+        """
+        Query with a streaming response, for async web servers
+        
+        Retrieval still uses the blocking client, so it runs in a worker thread;
+        the answer is streamed without holding a thread.
+        
+        Args:
+            question: User question
+            top_k: Number of chunks to retrieve
+            use_rerank: Whether to use LLM reranking
+            model: LLM model for generation (defaults to the client's model)
+            context_chunks: Already retrieved chunks (skips retrieval)
+        
+        Yields:
+            Response chunks as they are generated
+        """
+        if context_chunks is None:
+            context_chunks = await asyncio.to_thread(
+                self.retrieve_context, question, top_k=top_k, use_rerank=use_rerank)
+        
+        async for chunk in self.generator.agenerate_stream(question, context_chunks, model=model):
+            yield chunk
+    
+    def analyze_messy_data(self, file_path: str, data: Optional[bytes] = None) -> Dict[str, Any]:
         """
         Special analysis for messy/unorganized data
         
         Args:
             file_path: Path to messy data file
+            data: In-memory contents, written to file_path after a successful parse
         
         Returns:
             Analysis and interpretation
@@ -199,7 +602,7 @@ class RAGPipeline:
         logger.info(f"Analyzing messy data: {file_path}")
         
         # Parse document
-        parsed_doc = self.parser.parse(file_path)
+        parsed_doc = self.parser.parse(file_path, data)
         
         if not parsed_doc['success']:
             return {
@@ -207,6 +610,9 @@ class RAGPipeline:
                 'error': parsed_doc.get('error', 'Unknown error')
             }
         
+        if data is not None:
+            self._persist_upload(file_path, data)
+        
         # Process with special attention to messy data
         processed_doc = self.preprocessor.process_document(parsed_doc)
         
@@ -246,6 +652,24 @@ class RAGPipeline:
             'ollama_available': self.ollama.is_available()
         }
     
+    def clear_all(self) -> Dict[str, Any]:
+        """
+        Remove every chunk from the vector store and save it
+        
+        Returns:
+            Result with the number of chunks removed
+        """
+        with self._write_lock:
+            with self._store_lock:
+                chunks_removed = self.vector_store.get_stats()['total_chunks']
+                self.vector_store.clear()
+            self.vector_store.save()
+            
+            return {
+                'status': 'success',
+                'chunks_removed': chunks_removed
+            }
+    
     def delete_document(self, filename: str) -> Dict[str, Any]:
         """
         Delete a document from the system
@@ -256,28 +680,37 @@ class RAGPipeline:
         Returns:
             Deletion result
         """
-        # Find and remove from processed docs
-        hash_to_remove = None
-        for file_hash, doc_info in self.processed_docs.items():
-            if doc_info['file_name'] == filename:
-                hash_to_remove = file_hash
-                break
-        
-        if hash_to_remove:
-            del self.processed_docs[hash_to_remove]
-            save_metadata(self.processed_docs)
-        
-        # Remove from vector store
-        chunks_removed = self.vector_store.delete_by_filename(filename)
-        
-        if chunks_removed > 0:
-            self.vector_store.save()
-        
-        return {
-            'status': 'success',
-            'chunks_removed': chunks_removed,
-            'filename': filename
-        }
+        with self._write_lock:
+            # Find and remove from processed docs
+            hash_to_remove = None
+            for file_hash, doc_info in self.processed_docs.items():
+                if doc_info['file_name'] == filename:
+                    hash_to_remove = file_hash
+                    break
+            
+            if hash_to_remove:
+                del self.processed_docs[hash_to_remove]
+            
+            # Remove from vector store
+            with self._store_lock:
+                chunks_removed = self.vector_store.delete_by_filename(filename)
+            
+            # Vectors go to disk before the metadata, as in flush(), so a crash
+            # cannot leave documents marked processed without their vectors
+            if chunks_removed > 0:
+                self.vector_store.save()
+            else:
+                self.vector_store.flush()
+            if hash_to_remove or self._unsaved_docs:
+                save_metadata(self.processed_docs)
+            self._unsaved_docs = 0
+            self._last_save = time.time()
+            
+            return {
+                'status': 'success',
+                'chunks_removed': chunks_removed,
+                'filename': filename
+            }
 
 
 logger.info("RAG Pipeline initialized")
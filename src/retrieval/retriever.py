@@ -2,9 +2,13 @@
 Retrieval module for RAG system
 """
 import logging
+import threading
+from contextlib import nullcontext
+from concurrent.futures import ThreadPoolExecutor
 from typing import List, Dict, Any, Optional
 from src.vectorstore.faiss_store import FAISSVectorStore
 from src.utils.ollama_client import OllamaClient
+from src.utils.helpers import LRUCache, text_key
 import config
 
 logger = logging.getLogger(__name__)
@@ -16,9 +20,21 @@ class Retriever:
     """
     
     def __init__(self, vector_store: Optional[FAISSVectorStore] = None,
-                 ollama_client: Optional[OllamaClient] = None):
+                 ollama_client: Optional[OllamaClient] = None,
+                 store_lock=None):
         self.vector_store = vector_store or FAISSVectorStore()
         self.ollama = ollama_client or OllamaClient()
+        
+        # Held only while reading the vector store, so writers sharing it are
+        # excluded without queueing on query embedding or reranking
+        self._store_lock = store_lock or nullcontext()
+        
+        # Cross-encoder reranker, loaded on first use (False once loading failed)
+        self._reranker = None
+        self._reranker_lock = threading.Lock()
+        
+        # Rerank scores by (scorer, query, chunk text), reused for repeated queries
+        self._rerank_cache = LRUCache(config.RERANK_CACHE_SIZE)
     
     def retrieve(self, query: str, top_k: int = config.TOP_K_RETRIEVAL) -> List[Dict[str, Any]]:
         """
@@ -34,34 +50,124 @@ class Retriever:
         logger.info(f"Retrieving context for query: {query[:100]}...")
         
         # Retrieve from vector store
-        results = self.vector_store.search(query, top_k=top_k)
+        results = self._search(query, top_k)
+        
+        return self._attach_analysis_chunks(results)
+    
+    def _search(self, query: str, top_k: int) -> List[Dict[str, Any]]:
+        """Embed the query, then search the vector store under the store lock"""
+        query_embedding = self.ollama.get_embedding(query)
+        with self._store_lock:
+            return self.vector_store.search(query, top_k=top_k, query_embedding=query_embedding)
+    
+    def _attach_analysis_chunks(self, results: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+        """
+        Splice in the analysis chunk for any retrieved tabular data chunk
+        
+        Tabular data chunks only reference their table's analysis, so it is
+        added ahead of the first data chunk that needs it unless it was
+        already retrieved on its own.
+        """
+        present = {r['metadata'].get('context', {}).get('chunk_id') for r in results}
         
-        return results
+        spliced = []
+        for result in results:
+            chunk_id = result['metadata'].get('context', {}).get('analysis_chunk_id')
+            if chunk_id and chunk_id not in present:
+                with self._store_lock:
+                    analysis_chunk = self.vector_store.get_chunk_by_id(chunk_id)
+                if analysis_chunk:
+                    analysis_chunk['score'] = result['score']
+                    spliced.append(analysis_chunk)
+                present.add(chunk_id)
+            spliced.append(result)
+        
+        return spliced
     
     def retrieve_with_rerank(self, query: str, 
                             top_k: int = config.TOP_K_RETRIEVAL,
-                            rerank_top_k: int = config.RERANK_TOP_K) -> List[Dict[str, Any]]:
+                            rerank_top_k: int = config.RERANK_TOP_K,
+                            use_llm_rerank: bool = config.USE_LLM_RERANK) -> List[Dict[str, Any]]:
         """
-        Retrieve and rerank results using LLM
+        Retrieve and rerank results
+        
+        Uses a local cross-encoder when sentence-transformers is installed,
+        otherwise (or when use_llm_rerank is set) asks the LLM to score chunks.
         
         Args:
             query: User query
             top_k: Initial retrieval count
             rerank_top_k: Final count after reranking
+            use_llm_rerank: Score with LLM prompts instead of the cross-encoder
         
         Returns:
             Reranked list of chunks
         """
-        # Initial retrieval
-        initial_results = self.retrieve(query, top_k=top_k)
+        # Initial retrieval (analysis chunks are attached after reranking so
+        # the cut to rerank_top_k cannot drop them)
+        initial_results = self._search(query, top_k)
         
         if len(initial_results) <= rerank_top_k:
-            return initial_results
+            return self._attach_analysis_chunks(initial_results)
+        
+        reranked = None
+        if not use_llm_rerank:
+            reranked = self._rerank_with_cross_encoder(query, initial_results, rerank_top_k)
+        
+        if reranked is None:
+            # Rerank using LLM
+            reranked = self._rerank_with_llm(query, initial_results, rerank_top_k)
+        
+        return self._attach_analysis_chunks(reranked)
+    
+    def _get_reranker(self):
+        """Load the cross-encoder once; returns None if it is unavailable"""
+        with self._reranker_lock:
+            if self._reranker is None:
+                try:
+                    from sentence_transformers import CrossEncoder
+                    self._reranker = CrossEncoder(config.RERANKER_MODEL)
+                    logger.info(f"Loaded reranker model {config.RERANKER_MODEL}")
+                except Exception as e:
+                    logger.warning(f"Cross-encoder reranker unavailable, using LLM reranking: {e}")
+                    self._reranker = False
+        
+        return self._reranker or None
+    
+    def _rerank_with_cross_encoder(self, query: str, chunks: List[Dict[str, Any]],
+                                   top_k: int) -> Optional[List[Dict[str, Any]]]:
+        """
+        Rerank chunks with one batched cross-encoder pass over (query, text) pairs
+        
+        Returns:
+            Top chunks by rerank score, or None if no cross-encoder is available
+        """
+        reranker = self._get_reranker()
+        if reranker is None:
+            return None
+        
+        logger.info(f"Cross-encoder reranking {len(chunks)} chunks to top {top_k}")
+        
+        keys = [text_key(config.RERANKER_MODEL, query, chunk['text']) for chunk in chunks]
+        scores = [self._rerank_cache.get(key) for key in keys]
+        missing = [i for i, score in enumerate(scores) if score is None]
         
-        # Rerank using LLM
-        reranked = self._rerank_with_llm(query, initial_results, rerank_top_k)
+        if missing:
+            try:
+                predicted = reranker.predict([(query, chunks[i]['text'][:512]) for i in missing],
+                                             batch_size=32)
+            except Exception as e:
+                logger.warning(f"Cross-encoder reranking failed, using LLM reranking: {e}")
+                return None
+            
+            for i, score in zip(missing, predicted):
+                scores[i] = float(score)
+                self._rerank_cache.set(keys[i], scores[i])
+        
+        for chunk, score in zip(chunks, scores):
+            chunk['rerank_score'] = score
         
-        return reranked
+        return sorted(chunks, key=lambda x: x['rerank_score'], reverse=True)[:top_k]
     
     def _rerank_with_llm(self, query: str, chunks: List[Dict[str, Any]], 
                          top_k: int) -> List[Dict[str, Any]]:
@@ -75,25 +181,14 @@ class Retriever:
         # For efficiency, use a simple scoring approach
         # In production, you might use a dedicated reranking model
         
+        # Each chunk is scored independently, so the prompts are sent
+        # concurrently and Ollama can queue or batch them
+        workers = min(config.RERANK_CONCURRENCY, len(chunks))
+        with ThreadPoolExecutor(max_workers=workers) as executor:
+            scores = list(executor.map(lambda chunk: self._score_chunk(query, chunk), chunks))
+        
         scored_chunks = []
-        for chunk in chunks:
-            # Create a simple relevance prompt
-            prompt = f"""On a scale of 0-10, how relevant is this text to answering the question?
-Question: {query}
-
-Text: {chunk['text'][:500]}
-
-Relevance score (0-10):"""
-            
-            try:
-                response = self.ollama.generate(prompt, model=config.FAST_LLM_MODEL,
-                                              temperature=0.1)
-                # Extract numeric score
-                score_str = ''.join(filter(str.isdigit, response[:10]))
-                score = int(score_str) if score_str else chunk['score'] * 10
-            except:
-                score = chunk['score'] * 10
-            
+        for chunk, score in zip(chunks, scores):
             chunk['rerank_score'] = score
             scored_chunks.append(chunk)
         
@@ -102,6 +197,35 @@ Relevance score (0-10):"""
         
         return scored_chunks[:top_k]
     
+    def _score_chunk(self, query: str, chunk: Dict[str, Any]) -> float:
+        """Ask the LLM for a 0-10 relevance score, falling back to the vector score"""
+        cache_key = text_key(config.FAST_LLM_MODEL, query, chunk['text'])
+        cached = self._rerank_cache.get(cache_key)
+        if cached is not None:
+            return cached
+        
+        # Create a simple relevance prompt
+        prompt = f"""On a scale of 0-10, how relevant is this text to answering the question?
+Question: {query}
+
+Text: {chunk['text'][:500]}
+
+Relevance score (0-10):"""
+        
+        try:
+            response = self.ollama.generate(prompt, model=config.FAST_LLM_MODEL,
+                                          temperature=0.1)
+            # Extract numeric score
+            score_str = ''.join(filter(str.isdigit, response[:10]))
+            if not score_str:
+                return chunk['score'] * 10
+            
+            score = int(score_str)
+            self._rerank_cache.set(cache_key, score)
+            return score
+        except:
+            return chunk['score'] * 10
+    
     def retrieve_hybrid(self, query: str, keywords: List[str] = None,
                        top_k: int = config.TOP_K_RETRIEVAL) -> List[Dict[str, Any]]:
         """
@@ -121,10 +245,13 @@ Relevance score (0-10):"""
         if not keywords:
             return semantic_results
         
+        # Normalize keywords once rather than per chunk
+        keywords_lower = list(dict.fromkeys(kw.lower() for kw in keywords if kw))
+        
         # Boost scores for chunks containing keywords
         for result in semantic_results:
             text_lower = result['text'].lower()
-            keyword_matches = sum(1 for kw in keywords if kw.lower() in text_lower)
+            keyword_matches = sum(1 for kw in keywords_lower if kw in text_lower)
             
             # Boost score based on keyword matches
             if keyword_matches > 0:
@@ -2,14 +2,23 @@
 Helper utilities for ReasonableRAG system
 """
 import os
+import re
 import logging
 import json
 import hashlib
-from typing import List, Dict, Any, Optional
+import mmap
+import sqlite3
+import threading
+import functools
+from array import array
+from collections import OrderedDict
+from importlib.util import find_spec
+from typing import List, Dict, Any, Optional, Union, Iterable, Hashable
 from datetime import datetime
 import config
 
-# Setup logging
+# Setup logging (the file handler needs its directory to exist)
+os.makedirs(config.LOG_DIR, exist_ok=True)
 logging.basicConfig(
     level=getattr(logging, config.LOG_LEVEL),
     format='%(asctime)s - %(name)s - %(levelname)s - %(message)s',
@@ -21,14 +30,240 @@ logging.basicConfig(
 
 logger = logging.getLogger(__name__)
 
+# Dedup hash: BLAKE3 keys are prefixed so plain SHA-256 keys from older
+# metadata stay recognisable (and still match via the legacy hash)
+HASH_ENGINE = 'blake3' if find_spec('blake3') else 'sha256'
+HASH_PREFIX = 'b3:'
 
-def get_file_hash(file_path: str) -> str:
-    """Generate SHA256 hash of a file for deduplication"""
-    sha256_hash = hashlib.sha256()
+# JSON codec: orjson is several times faster than the stdlib json
+JSON_ENGINE = 'orjson' if find_spec('orjson') else 'json'
+
+# Token counting: tiktoken's Rust tokenizer when installed, else ~4 chars/token
+TOKENIZER_ENGINE = 'tiktoken' if find_spec('tiktoken') else None
+
+# Sentence ending followed by a space or newline, for chunk boundaries
+_SENT_END = re.compile(r'[.!?][ \n]')
+
+
+def get_file_hash(file_path: str, legacy: bool = False) -> str:
+    """
+    Generate a content hash of a file for deduplication
+    
+    Args:
+        file_path: Path to the file
+        legacy: Return the unprefixed SHA-256 key used by older metadata
+    
+    Returns:
+        'b3:'-prefixed BLAKE3 hex digest when blake3 is installed, otherwise
+        the SHA-256 hex digest
+    """
     with open(file_path, "rb") as f:
-        for byte_block in iter(lambda: f.read(4096), b""):
+        if HASH_ENGINE == 'blake3' and not legacy:
+            from blake3 import blake3
+            hasher = blake3(max_threads=blake3.AUTO)
+            # mmap lets the multithreaded hasher read the file without copying
+            # it into Python (zero-length files cannot be mapped)
+            if os.fstat(f.fileno()).st_size:
+                with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mapped:
+                    hasher.update(mapped)
+            return HASH_PREFIX + hasher.hexdigest()
+        
+        # Python 3.11+ runs the whole read/hash loop in C
+        if hasattr(hashlib, 'file_digest'):
+            return hashlib.file_digest(f, "sha256").hexdigest()
+        
+        sha256_hash = hashlib.sha256()
+        for byte_block in iter(lambda: f.read(1 << 20), b""):
             sha256_hash.update(byte_block)
-    return sha256_hash.hexdigest()
+        return sha256_hash.hexdigest()
+
+
+def get_bytes_hash(data: bytes, legacy: bool = False) -> str:
+    """Generate a content hash of in-memory file contents (same key as get_file_hash)"""
+    if HASH_ENGINE == 'blake3' and not legacy:
+        from blake3 import blake3
+        return HASH_PREFIX + blake3(data, max_threads=blake3.AUTO).hexdigest()
+    
+    return hashlib.sha256(data).hexdigest()
+
+
+def json_loads(data: Union[str, bytes]) -> Any:
+    """Parse JSON text or bytes (with orjson when it is installed)"""
+    if JSON_ENGINE == 'orjson':
+        import orjson
+        return orjson.loads(data)
+    return json.loads(data)
+
+
+def json_dumps(value: Any) -> bytes:
+    """Serialize to compact UTF-8 JSON bytes (with orjson when it is installed)"""
+    if JSON_ENGINE == 'orjson':
+        import orjson
+        return orjson.dumps(value, option=orjson.OPT_NON_STR_KEYS)
+    return json.dumps(value, ensure_ascii=False).encode('utf-8')
+
+
+def cache_get(cache_dir: str, key: str) -> Optional[Dict[str, Any]]:
+    """Read a cached JSON entry, or None if it is missing or unreadable"""
+    path = os.path.join(cache_dir, f"{key}.json")
+    if not os.path.exists(path):
+        return None
+    
+    try:
+        with open(path, 'rb') as f:
+            return json_loads(f.read())
+    except Exception as e:
+        logger.warning(f"Ignoring unreadable cache entry {path}: {e}")
+        return None
+
+
+def cache_set(cache_dir: str, key: str, value: Dict[str, Any]):
+    """Write a JSON cache entry atomically so readers never see partial files"""
+    os.makedirs(cache_dir, exist_ok=True)
+    path = os.path.join(cache_dir, f"{key}.json")
+    tmp_path = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+    
+    try:
+        with open(tmp_path, 'wb') as f:
+            f.write(json_dumps(value))
+        os.replace(tmp_path, path)
+    except Exception as e:
+        logger.warning(f"Could not write cache entry {path}: {e}")
+
+
+def text_key(*parts: str) -> str:
+    """Short stable hash of one or more strings, for use as an in-memory cache key"""
+    digest = hashlib.blake2b(digest_size=16)
+    for part in parts:
+        digest.update(part.encode('utf-8'))
+        digest.update(b'\0')
+    return digest.hexdigest()
+
+
+class LRUCache:
+    """Small thread-safe least-recently-used cache"""
+    
+    def __init__(self, maxsize: int):
+        self.maxsize = maxsize
+        self._data: OrderedDict = OrderedDict()
+        self._lock = threading.Lock()
+    
+    def get(self, key: Hashable) -> Any:
+        """Return the cached value (marking it recently used), or None"""
+        with self._lock:
+            if key not in self._data:
+                return None
+            self._data.move_to_end(key)
+            return self._data[key]
+    
+    def set(self, key: Hashable, value: Any):
+        """Store a value, evicting the least recently used entry when full"""
+        with self._lock:
+            self._data[key] = value
+            self._data.move_to_end(key)
+            while len(self._data) > self.maxsize:
+                self._data.popitem(last=False)
+
+
+class VectorCache:
+    """
+    Thread-safe on-disk cache of float32 vectors in a single SQLite file
+    
+    Each entry records when it was last used; once more than max_entries
+    are stored, the least recently used are evicted. The database is opened
+    on first use.
+    """
+    
+    # Keys per SELECT, below SQLite's bound-parameter limit
+    _QUERY_CHUNK = 500
+    
+    def __init__(self, path: str, max_entries: int):
+        self.path = path
+        self.max_entries = max_entries
+        self._lock = threading.Lock()
+        self._conn: Optional[sqlite3.Connection] = None
+        self._rows = 0  # Entries stored (approximate between evictions)
+        self._clock = 0  # Last-used stamp for the next lookup or store
+    
+    def _connect(self) -> sqlite3.Connection:
+        if self._conn is None:
+            os.makedirs(os.path.dirname(self.path) or '.', exist_ok=True)
+            conn = sqlite3.connect(self.path, check_same_thread=False)
+            # WAL with normal sync: a commit appends to the log instead of
+            # syncing the whole database every time
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            conn.execute("CREATE TABLE IF NOT EXISTS vectors "
+                         "(key TEXT PRIMARY KEY, vector BLOB NOT NULL, used INTEGER NOT NULL)")
+            conn.execute("CREATE INDEX IF NOT EXISTS vectors_used ON vectors (used)")
+            self._rows, self._clock = conn.execute(
+                "SELECT COUNT(*), COALESCE(MAX(used), 0) FROM vectors").fetchone()
+            self._conn = conn
+        return self._conn
+    
+    def get_many(self, keys: List[str]) -> Dict[str, List[float]]:
+        """
+        Look up several vectors at once
+        
+        Args:
+            keys: Cache keys
+        
+        Returns:
+            Vectors for the keys that are cached (missing keys are left out)
+        """
+        found = {}
+        with self._lock:
+            try:
+                conn = self._connect()
+                for start in range(0, len(keys), self._QUERY_CHUNK):
+                    part = keys[start:start + self._QUERY_CHUNK]
+                    marks = ','.join('?' * len(part))
+                    for key, blob in conn.execute(
+                            f"SELECT key, vector FROM vectors WHERE key IN ({marks})", part):
+                        vector = array('f')
+                        vector.frombytes(blob)
+                        found[key] = vector.tolist()
+                
+                if found:
+                    self._clock += 1
+                    conn.executemany("UPDATE vectors SET used = ? WHERE key = ?",
+                                     [(self._clock, key) for key in found])
+                    conn.commit()
+            except sqlite3.Error as e:
+                logger.warning(f"Vector cache read failed: {e}")
+        return found
+    
+    def set_many(self, items: Dict[str, List[float]]):
+        """
+        Store several vectors in one transaction, evicting old entries if full
+        
+        Args:
+            items: Vectors by cache key
+        """
+        if not items:
+            return
+        
+        with self._lock:
+            try:
+                conn = self._connect()
+                self._clock += 1
+                conn.executemany("INSERT OR REPLACE INTO vectors (key, vector, used) VALUES (?, ?, ?)",
+                                 [(key, array('f', vector).tobytes(), self._clock)
+                                  for key, vector in items.items()])
+                self._rows += len(items)
+                
+                if self._rows > self.max_entries:
+                    # Evict down to 90% so the next batches do not evict again
+                    self._rows = conn.execute("SELECT COUNT(*) FROM vectors").fetchone()[0]
+                    excess = self._rows - int(self.max_entries * 0.9)
+                    if self._rows > self.max_entries and excess > 0:
+                        conn.execute("DELETE FROM vectors WHERE key IN "
+                                     "(SELECT key FROM vectors ORDER BY used LIMIT ?)", (excess,))
+                        self._rows -= excess
+                        logger.info(f"Evicted {excess} least recently used cached vectors")
+                conn.commit()
+            except sqlite3.Error as e:
+                logger.warning(f"Vector cache write failed: {e}")
 
 
 def get_file_extension(file_path: str) -> str:
@@ -42,14 +277,17 @@ def is_supported_file(file_path: str) -> bool:
 
 
 def save_metadata(metadata: Dict[str, Any], file_path: str = config.METADATA_PATH):
-    """Save metadata to JSON file"""
+    """Save metadata to JSON file, replacing it atomically so a crash never leaves it half-written"""
+    tmp_path = f"{file_path}.{os.getpid()}.{threading.get_ident()}.tmp"
+    
     try:
         # Load existing metadata
         existing = load_metadata(file_path)
         existing.update(metadata)
         
-        with open(file_path, 'w', encoding='utf-8') as f:
-            json.dump(existing, f, indent=2, ensure_ascii=False)
+        with open(tmp_path, 'wb') as f:
+            f.write(json_dumps(existing))
+        os.replace(tmp_path, file_path)
         logger.info(f"Metadata saved to {file_path}")
     except Exception as e:
         logger.error(f"Error saving metadata: {e}")
@@ -62,8 +300,8 @@ def load_metadata(file_path: str = config.METADATA_PATH) -> Dict[str, Any]:
         return {}
     
     try:
-        with open(file_path, 'r', encoding='utf-8') as f:
-            return json.load(f)
+        with open(file_path, 'rb') as f:
+            return json_loads(f.read())
     except Exception as e:
         logger.error(f"Error loading metadata: {e}")
         return {}
@@ -91,33 +329,57 @@ def chunk_text(text: str, chunk_size: int = config.CHUNK_SIZE,
     while start < len(text):
         end = start + chunk_size
         
-        # Try to break at sentence boundary
+        # Try to break at the last sentence boundary in the window
+        # (one scan of the original string, no slice per window)
         if end < len(text):
-            # Look for sentence endings
-            for delimiter in ['. ', '.\n', '! ', '?\n', '? ']:
-                last_delim = text[start:end].rfind(delimiter)
-                if last_delim != -1:
-                    end = start + last_delim + len(delimiter)
-                    break
+            match = None
+            for match in _SENT_END.finditer(text, start, end):
+                pass
+            if match:
+                end = match.end()
+        
+        # Trim whitespace on indices so the chunk is sliced only once, and
+        # only if it is long enough to keep
+        chunk_start, chunk_end = start, min(end, len(text))
+        while chunk_start < chunk_end and text[chunk_start].isspace():
+            chunk_start += 1
+        while chunk_end > chunk_start and text[chunk_end - 1].isspace():
+            chunk_end -= 1
+        
+        if chunk_end - chunk_start >= config.MIN_CHUNK_SIZE:
+            chunks.append(text[chunk_start:chunk_end])
         
-        chunk = text[start:end].strip()
-        if len(chunk) >= config.MIN_CHUNK_SIZE:
-            chunks.append(chunk)
+        if end >= len(text):
+            break
         
-        start = end - overlap
+        # Always advance, even when a boundary falls inside the overlap
+        start = max(end - overlap, start + 1)
     
     return chunks
 
 
-def chunk_text_semantic(text: str, chunk_size: int = config.CHUNK_SIZE) -> List[Dict[str, Any]]:
+def chunk_text_semantic(text: Union[str, Iterable[str]],
+                        chunk_size: int = config.CHUNK_SIZE) -> List[Dict[str, Any]]:
     """
     Split text into semantic chunks with metadata
     
+    Text may also be given as an iterable of sections (e.g. streamed PDF
+    pages), which is chunked exactly as if the sections were joined with
+    blank lines, without building the joined string.
+    
     Returns chunks with context information
     """
-    paragraphs = text.split('\n\n')
+    if isinstance(text, str):
+        paragraphs = text.split('\n\n')
+    else:
+        paragraphs = (para for section in text for para in section.split('\n\n'))
     chunks = []
-    current_chunk = ""
+    timestamp = datetime.now().isoformat()
+    
+    # Paragraphs are collected in a list (joined once per chunk) instead of
+    # growing a string; current_len counts the "\n\n" after each paragraph
+    current_paras: List[str] = []
+    current_len = 0
     chunk_index = 0
     
     for para in paragraphs:
@@ -125,24 +387,26 @@ def chunk_text_semantic(text: str, chunk_size: int = config.CHUNK_SIZE) -> List[
         if not para:
             continue
         
-        if len(current_chunk) + len(para) < chunk_size:
-            current_chunk += para + "\n\n"
+        if current_len + len(para) < chunk_size:
+            current_paras.append(para)
+            current_len += len(para) + 2
         else:
-            if current_chunk:
+            if current_paras:
                 chunks.append({
-                    'text': current_chunk.strip(),
+                    'text': '\n\n'.join(current_paras),
                     'chunk_index': chunk_index,
-                    'timestamp': datetime.now().isoformat()
+                    'timestamp': timestamp
                 })
                 chunk_index += 1
-            current_chunk = para + "\n\n"
+            current_paras = [para]
+            current_len = len(para) + 2
     
     # Add last chunk
-    if current_chunk:
+    if current_paras:
         chunks.append({
-            'text': current_chunk.strip(),
+            'text': '\n\n'.join(current_paras),
             'chunk_index': chunk_index,
-            'timestamp': datetime.now().isoformat()
+            'timestamp': timestamp
         })
     
     return chunks
@@ -174,18 +438,91 @@ def format_document_context(chunks: List[str], metadata: Optional[Dict[str, Any]
     return "\n".join(context_parts)
 
 
+@functools.lru_cache(maxsize=1)
+def _get_encoder():
+    """Load the tiktoken encoding once, or None when it is unavailable"""
+    if TOKENIZER_ENGINE is None:
+        return None
+    
+    try:
+        import tiktoken
+        return tiktoken.get_encoding(config.TOKENIZER_ENCODING)
+    except Exception as e:
+        # e.g. the encoding file cannot be downloaded on an offline machine
+        logger.warning(f"tiktoken unavailable, estimating tokens from length: {e}")
+        return None
+
+
 def estimate_tokens(text: str) -> int:
-    """Rough estimation of token count (1 token ≈ 4 characters for English)"""
-    return len(text) // 4
+    """Estimate token count (tiktoken when available, else 1 token ≈ 4 characters)"""
+    encoder = _get_encoder()
+    if encoder is None:
+        return len(text) // 4
+    
+    return len(encoder.encode_ordinary(text))
+
+
+def estimate_tokens_batch(texts: List[str]) -> List[int]:
+    """Estimate token counts for many texts, tokenizing them in parallel"""
+    encoder = _get_encoder()
+    if encoder is None:
+        return [len(text) // 4 for text in texts]
+    
+    tokens = encoder.encode_ordinary_batch(texts, num_threads=os.cpu_count() or 1)
+    return [len(t) for t in tokens]
 
 
 def truncate_context(text: str, max_tokens: int = config.MAX_TOKENS) -> str:
     """Truncate text to fit within token limit"""
-    max_chars = max_tokens * 4
-    if len(text) <= max_chars:
+    encoder = _get_encoder()
+    if encoder is None:
+        max_chars = max_tokens * 4
+        if len(text) <= max_chars:
+            return text
+        
+        return text[:max_chars] + "..."
+    
+    tokens = encoder.encode_ordinary(text)
+    if len(tokens) <= max_tokens:
         return text
     
-    return text[:max_chars] + "..."
+    return encoder.decode(tokens[:max_tokens]) + "..."
+
+
+def fit_chunks_to_budget(chunks: List[Dict[str, Any]],
+                         max_tokens: int = config.MAX_TOKENS) -> List[str]:
+    """
+    Pick chunk texts in order until their token counts fill the budget
+    
+    Uses the 'token_count' stored in chunk metadata at ingest time, so no
+    text has to be measured per query. Older chunks without a count fall
+    back to estimate_tokens.
+    
+    Args:
+        chunks: Retrieved chunks with 'text' and 'metadata'
+        max_tokens: Token budget for the combined context
+    
+    Returns:
+        Chunk texts that fit; the first chunk is truncated if it alone is too long
+    """
+    texts = []
+    used = 0
+    
+    for chunk in chunks:
+        text = chunk['text']
+        count = chunk.get('metadata', {}).get('token_count')
+        if count is None:
+            count = estimate_tokens(text)
+        
+        if used + count > max_tokens:
+            if not texts:
+                texts.append(truncate_context(text, max_tokens=max_tokens))
+            break
+        
+        texts.append(text)
+        used += count
+    
+    return texts
 
 
 logger.info("Helper utilities loaded successfully")
@@ -2,9 +2,12 @@
 Ollama client wrapper for LLM and embedding operations
 """
 import requests
-import json
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
 import logging
-from typing import List, Dict, Any, Optional
+import time
+from typing import List, Dict, Any, Optional, Tuple, AsyncIterator
+from src.utils.helpers import LRUCache, VectorCache, text_key, json_loads
 import config
 
 logger = logging.getLogger(__name__)
@@ -18,10 +21,36 @@ class OllamaClient:
         self.embedding_model = config.EMBEDDING_MODEL
         self.llm_model = config.LLM_MODEL
         self.fast_llm = config.FAST_LLM_MODEL
+        
+        # One pooled session for every call, so requests reuse keep-alive
+        # connections instead of opening a new socket each time
+        self.session = requests.Session()
+        adapter = HTTPAdapter(
+            pool_connections=8,
+            pool_maxsize=config.OLLAMA_POOL_SIZE,
+            max_retries=Retry(total=config.OLLAMA_CONNECT_RETRIES,
+                              connect=config.OLLAMA_CONNECT_RETRIES,
+                              read=0, status=0, backoff_factor=0.3)
+        )
+        self.session.mount("http://", adapter)
+        self.session.mount("https://", adapter)
+        self.session.headers.update({"Connection": "keep-alive"})
+        
+        # Repeated queries skip the embedding round trip
+        self._embedding_cache = LRUCache(config.EMBEDDING_CACHE_SIZE)
+        
+        # Chunk embeddings persist across runs in one SQLite file
+        self._vector_cache = (VectorCache(config.EMBEDDING_CACHE_PATH, config.EMBEDDING_CACHE_MAX_ENTRIES)
+                              if config.EMBEDDING_CACHE_MAX_ENTRIES > 0 else None)
+        
+        # Last /api/tags result as (monotonic time, model names or None if
+        # unreachable); cleared whenever a request fails
+        self._tags: Optional[Tuple[float, Optional[List[str]]]] = None
     
     def generate(self, prompt: str, model: Optional[str] = None, 
                  temperature: float = config.LLM_TEMPERATURE,
-                 stream: bool = False, system: Optional[str] = None) -> str:
+                 stream: bool = False, system: Optional[str] = None,
+                 seed: Optional[int] = None) -> str:
         """
         Generate text using Ollama LLM
         
@@ -31,6 +60,7 @@ class OllamaClient:
             temperature: Sampling temperature
             stream: Whether to stream response
             system: System prompt
+            seed: Fixed sampling seed for reproducible output
         
         Returns:
             Generated text
@@ -41,6 +71,7 @@ class OllamaClient:
             "model": model,
             "prompt": prompt,
             "stream": stream,
+            "keep_alive": config.OLLAMA_KEEP_ALIVE,
             "options": {
                 "temperature": temperature,
                 "top_p": config.LLM_TOP_P,
@@ -51,37 +82,33 @@ class OllamaClient:
         
         if system:
             payload["system"] = system
+        if seed is not None:
+            payload["options"]["seed"] = seed
         
         try:
-            response = requests.post(
+            response = self.session.post(
                 f"{self.base_url}/api/generate",
                 json=payload,
                 timeout=300  # 5 minutes timeout for large responses
             )
             response.raise_for_status()
             
-            result = response.json()
+            result = json_loads(response.content)
             return result.get('response', '')
         
         except requests.exceptions.RequestException as e:
             logger.error(f"Error generating text with Ollama: {e}")
+            self._tags = None
             raise
     
-    def generate_stream(self, prompt: str, model: Optional[str] = None,
-                       temperature: float = config.LLM_TEMPERATURE,
-                       system: Optional[str] = None):
-        """
-        Stream generate text using Ollama LLM
-        
-        Yields:
-            Text chunks as they are generated
-        """
-        model = model or self.llm_model
-        
+    def _stream_payload(self, prompt: str, model: Optional[str], temperature: float,
+                        system: Optional[str]) -> Dict[str, Any]:
+        """Request body shared by the sync and async streaming calls"""
         payload = {
-            "model": model,
+            "model": model or self.llm_model,
             "prompt": prompt,
             "stream": True,
+            "keep_alive": config.OLLAMA_KEEP_ALIVE,
             "options": {
                 "temperature": temperature,
                 "top_p": config.LLM_TOP_P,
@@ -93,8 +120,21 @@ class OllamaClient:
         if system:
             payload["system"] = system
         
+        return payload
+    
+    def generate_stream(self, prompt: str, model: Optional[str] = None,
+                       temperature: float = config.LLM_TEMPERATURE,
+                       system: Optional[str] = None):
+        """
+        Stream generate text using Ollama LLM
+        
+        Yields:
+            Text chunks as they are generated
+        """
+        payload = self._stream_payload(prompt, model, temperature, system)
+        
         try:
-            response = requests.post(
+            response = self.session.post(
                 f"{self.base_url}/api/generate",
                 json=payload,
                 stream=True,
@@ -104,11 +144,44 @@ class OllamaClient:
             
             for line in response.iter_lines():
                 if line:
-                    chunk = json.loads(line)
+                    chunk = json_loads(line)
                     if 'response' in chunk:
                         yield chunk['response']
         
         except requests.exceptions.RequestException as e:
+            logger.error(f"Error streaming text with Ollama: {e}")
+            self._tags = None
+            raise
+    
+    async def agenerate_stream(self, prompt: str, model: Optional[str] = None,
+                               temperature: float = config.LLM_TEMPERATURE,
+                               system: Optional[str] = None) -> AsyncIterator[str]:
+        """
+        Stream generate text without blocking a thread while waiting on Ollama
+        
+        Requires httpx. Meant for async web servers, where many concurrent
+        streams can share one event loop.
+        
+        Yields:
+            Text chunks as they are generated
+        """
+        import httpx
+        
+        payload = self._stream_payload(prompt, model, temperature, system)
+        
+        try:
+            async with httpx.AsyncClient(timeout=300) as client:
+                async with client.stream("POST", f"{self.base_url}/api/generate",
+                                         json=payload) as response:
+                    response.raise_for_status()
+                    
+                    async for line in response.aiter_lines():
+                        if line:
+                            chunk = json_loads(line)
+                            if 'response' in chunk:
+                                yield chunk['response']
+        
+        except httpx.HTTPError as e:
             logger.error(f"Error streaming text with Ollama: {e}")
             raise
     
@@ -116,6 +189,9 @@ class OllamaClient:
         """
         Get embedding vector for text
         
+        Results are kept in an in-memory LRU cache, so a repeated query
+        costs a dictionary lookup instead of a model forward pass.
+        
         Args:
             text: Input text
             model: Embedding model name
@@ -125,38 +201,105 @@ class OllamaClient:
         """
         model = model or self.embedding_model
         
+        cache_key = text_key(model, text)
+        cached = self._embedding_cache.get(cache_key)
+        if cached is not None:
+            return cached
+        
         payload = {
             "model": model,
-            "prompt": text
+            "prompt": text,
+            "keep_alive": config.OLLAMA_KEEP_ALIVE
         }
         
         try:
-            response = requests.post(
+            response = self.session.post(
                 f"{self.base_url}/api/embeddings",
                 json=payload,
                 timeout=60
             )
             response.raise_for_status()
             
-            result = response.json()
-            return result.get('embedding', [])
+            result = json_loads(response.content)
+            embedding = result.get('embedding', [])
+            if embedding:
+                self._embedding_cache.set(cache_key, embedding)
+            return embedding
         
         except requests.exceptions.RequestException as e:
             logger.error(f"Error getting embedding from Ollama: {e}")
+            self._tags = None
             raise
     
     def get_embeddings_batch(self, texts: List[str], 
-                            model: Optional[str] = None) -> List[List[float]]:
+                            model: Optional[str] = None,
+                            batch_size: int = config.EMBEDDING_BATCH_SIZE) -> List[List[float]]:
         """
         Get embeddings for multiple texts
         
+        Texts are sent to /api/embed in sub-batches of batch_size, so any
+        caller (including full re-indexing) gets batched forward passes with
+        bounded request size and memory.
+        
         Args:
             texts: List of input texts
             model: Embedding model name
+            batch_size: Maximum texts per request
         
         Returns:
             List of embedding vectors
         """
+        model = model or self.embedding_model
+        
+        # Texts embedded before (re-uploads, re-indexing) come from the disk
+        # cache; only the rest are sent to Ollama
+        keys = [text_key(model, text) for text in texts]
+        cached = self._vector_cache.get_many(keys) if self._vector_cache else {}
+        embeddings = [cached.get(key) for key in keys]
+        missing = [i for i, embedding in enumerate(embeddings) if embedding is None]
+        
+        if len(missing) < len(texts):
+            logger.info(f"Reusing {len(texts) - len(missing)}/{len(texts)} cached embeddings")
+        
+        for start in range(0, len(missing), batch_size):
+            positions = missing[start:start + batch_size]
+            batch = self._embed_batch([texts[i] for i in positions], model)
+            for i, embedding in zip(positions, batch):
+                embeddings[i] = embedding
+            if self._vector_cache:
+                self._vector_cache.set_many({keys[i]: embedding
+                                             for i, embedding in zip(positions, batch) if embedding})
+        
+        return embeddings
+    
+    def _embed_batch(self, texts: List[str], model: str) -> List[List[float]]:
+        """
+        Embed one sub-batch with a single /api/embed request
+        
+        Falls back to one request per text if the batch call fails.
+        """
+        payload = {
+            "model": model,
+            "input": texts,
+            "keep_alive": config.OLLAMA_KEEP_ALIVE
+        }
+        
+        try:
+            response = self.session.post(
+                f"{self.base_url}/api/embed",
+                json=payload,
+                timeout=300
+            )
+            response.raise_for_status()
+            
+            embeddings = json_loads(response.content).get('embeddings', [])
+            if len(embeddings) == len(texts):
+                return embeddings
+            logger.warning(f"Batch embedding returned {len(embeddings)} vectors for {len(texts)} texts")
+        
+        except requests.exceptions.RequestException as e:
+            logger.warning(f"Batch embedding failed, falling back to per-text requests: {e}")
+        
         embeddings = []
         for text in texts:
             embedding = self.get_embedding(text, model)
@@ -183,6 +326,7 @@ class OllamaClient:
             "model": model,
             "messages": messages,
             "stream": False,
+            "keep_alive": config.OLLAMA_KEEP_ALIVE,
             "options": {
                 "temperature": temperature,
                 "top_p": config.LLM_TOP_P,
@@ -191,38 +335,110 @@ class OllamaClient:
         }
         
         try:
-            response = requests.post(
+            response = self.session.post(
                 f"{self.base_url}/api/chat",
                 json=payload,
                 timeout=300
             )
             response.raise_for_status()
             
-            result = response.json()
+            result = json_loads(response.content)
             return result.get('message', {}).get('content', '')
         
         except requests.exceptions.RequestException as e:
             logger.error(f"Error in chat with Ollama: {e}")
+            self._tags = None
             raise
     
-    def is_available(self) -> bool:
-        """Check if Ollama service is available"""
+    def warmup_embeddings(self, model: Optional[str] = None) -> bool:
+        """
+        Load the embedding model ahead of the first query
+        
+        Args:
+            model: Embedding model name (defaults to config.EMBEDDING_MODEL)
+        
+        Returns:
+            True if the warmup request succeeded
+        """
+        model = model or self.embedding_model
+        
         try:
-            response = requests.get(f"{self.base_url}/api/tags", timeout=5)
-            return response.status_code == 200
-        except:
+            self.get_embedding("warmup", model)
+            logger.info(f"Warmed up embedding model {model}")
+            return True
+        
+        except requests.exceptions.RequestException as e:
+            logger.warning(f"Embedding model warmup failed for {model}: {e}")
             return False
     
-    def list_models(self) -> List[str]:
-        """List available models"""
+    def warmup(self, system: Optional[str] = None, model: Optional[str] = None) -> bool:
+        """
+        Load a model and evaluate the system prompt ahead of the first query
+        
+        Args:
+            system: System prompt to cache
+            model: Model name (defaults to config.LLM_MODEL)
+        
+        Returns:
+            True if the warmup request succeeded
+        """
+        model = model or self.llm_model
+        
+        payload = {
+            "model": model,
+            "prompt": "Hi",  # An empty prompt only loads the model without evaluating
+            "stream": False,
+            "keep_alive": config.OLLAMA_KEEP_ALIVE,
+            "options": {"num_predict": 1}
+        }
+        
+        if system:
+            payload["system"] = system
+        
         try:
-            response = requests.get(f"{self.base_url}/api/tags", timeout=5)
+            response = self.session.post(
+                f"{self.base_url}/api/generate",
+                json=payload,
+                timeout=300
+            )
             response.raise_for_status()
-            models = response.json().get('models', [])
-            return [model['name'] for model in models]
+            logger.info(f"Warmed up model {model}")
+            return True
+        
+        except requests.exceptions.RequestException as e:
+            logger.warning(f"Model warmup failed for {model}: {e}")
+            return False
+    
+    def _fetch_tags(self) -> Optional[List[str]]:
+        """
+        Model names from /api/tags, or None if Ollama is unreachable
+        
+        The answer is reused for OLLAMA_STATUS_TTL seconds, so a polling UI
+        costs at most one request per interval for both status calls.
+        """
+        now = time.monotonic()
+        if self._tags is not None and now - self._tags[0] < config.OLLAMA_STATUS_TTL:
+            return self._tags[1]
+        
+        try:
+            response = self.session.get(f"{self.base_url}/api/tags", timeout=5)
+            response.raise_for_status()
+            models = json_loads(response.content).get('models', [])
+            names = [model['name'] for model in models]
         except Exception as e:
             logger.error(f"Error listing models: {e}")
-            return []
+            names = None
+        
+        self._tags = (now, names)
+        return names
+    
+    def is_available(self) -> bool:
+        """Check if Ollama service is available"""
+        return self._fetch_tags() is not None
+    
+    def list_models(self) -> List[str]:
+        """List available models"""
+        return list(self._fetch_tags() or [])
 
 
 logger.info("Ollama client initialized")
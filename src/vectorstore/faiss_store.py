@@ -2,17 +2,60 @@
 FAISS vector store for offline RAG system
 """
 import os
+import re
 import logging
 import json
 import pickle
-from typing import List, Dict, Any, Optional, Tuple
+import threading
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor
+from importlib.util import find_spec
+from typing import List, Dict, Any, Optional, Tuple, Union
 import numpy as np
+import config
+
+# faiss picks its SIMD build (generic/avx2/avx512) when first imported
+if config.FAISS_OPT_LEVEL:
+    os.environ.setdefault('FAISS_OPT_LEVEL', config.FAISS_OPT_LEVEL)
+
 import faiss
+import msgpack
+import zstandard
 from src.utils.ollama_client import OllamaClient
-import config
+from src.utils.helpers import estimate_tokens_batch
 
 logger = logging.getLogger(__name__)
 
+# Cap OpenMP threads so FAISS does not oversubscribe cores shared with Ollama
+faiss.omp_set_num_threads(config.FAISS_THREADS or max(1, (os.cpu_count() or 2) // 2))
+
+# msgpack encoder for the chunk store: msgspec is a few times faster, and
+# msgpack.Unpacker reads either encoder's output
+PACK_ENGINE = 'msgspec' if find_spec('msgspec') else 'msgpack'
+
+if PACK_ENGINE == 'msgspec':
+    import msgspec
+    _pack = msgspec.msgpack.Encoder().encode
+else:
+    def _pack(value: Any) -> bytes:
+        """Serialize a value to msgpack"""
+        return msgpack.packb(value, use_bin_type=True)
+
+# Trained encodings (int8 ranges, IVF centroids, PQ codebooks) learned from
+# fewer vectors than this generalize poorly to later documents
+MIN_TRAINING_VECTORS = 1000
+
+# Factory components that already choose how vectors are stored
+_STORAGE_COMPONENT = re.compile(r'(?:^|[,_])(?:Flat|PQ\d|SQ|LSH|RaBitQ)')
+
+# Layouts whose clusters or codebooks need far more training vectors than
+# a first document provides; rebuild_index() trains them on the full corpus
+_CORPUS_TRAINED_LAYOUT = re.compile(r'IVF|PQ\d')
+
+
+class StoreMismatchError(RuntimeError):
+    """Saved index and chunk store disagree in a way load() cannot repair"""
+
 
 class FAISSVectorStore:
     """
@@ -26,21 +69,134 @@ class FAISSVectorStore:
         self.metadata = []   # Store metadata for each chunk
         self.dimension = config.EMBEDDING_DIM
         self.index_path = config.FAISS_INDEX_PATH
+        self.store_path = os.path.join(config.VECTOR_DB_PATH, "chunks.msgpack.zst")
+        # Pickle files written by older versions, read once for migration
         self.docs_path = os.path.join(config.VECTOR_DB_PATH, "documents.pkl")
         self.meta_path = os.path.join(config.VECTOR_DB_PATH, "metadata.pkl")
+        # Exact copies of the indexed vectors (FAISS_KEEP_RAW_VECTORS), row i
+        # belonging to index position i
+        self.vectors_path = os.path.join(config.VECTOR_DB_PATH, "vectors.f32")
+        self._dirty = False  # In-memory changes not yet written by save()
+        self._mmapped = False  # Index is a read-only mapping of the saved file
+        self._on_gpu = False  # Index was copied to GPU memory
+        # Chunks already in the store file, or None when it must be rewritten
+        self._persisted_count: Optional[int] = 0
+        self._filename_counts = Counter()  # Chunks per source file, for get_stats
+        self._chunk_positions = {}  # chunk_id -> position, for get_chunk_by_id
+        self._raw_tracked = False  # Raw copies cover every vector in the index
+        self._raw_saved = None  # Read-only memmap of the rows in vectors.f32
+        self._raw_pending = []  # Rows added since the last save
+        self._raw_rewrite = False  # vectors.f32 must be replaced, not appended to
         
         # Try to load existing index
         self.load()
     
     def create_index(self):
-        """Create a new FAISS index"""
-        # Use IndexFlatL2 for exact search (good for offline use)
-        # For larger datasets, could use IndexIVFFlat
-        self.index = faiss.IndexFlatL2(self.dimension)
-        logger.info(f"Created new FAISS index with dimension {self.dimension}")
+        """
+        Create a new FAISS index
+        
+        Raises:
+            ValueError: If FAISS_INDEX_TYPE is an IVF or PQ layout
+        """
+        # HNSW gives approximate search in roughly O(log N) and supports
+        # incremental adds without training; "Flat" falls back to exact search.
+        # Inner product on L2-normalized vectors scores by cosine similarity.
+        factory = self._index_factory_string()
+        self.index = faiss.index_factory(self.dimension, factory, faiss.METRIC_INNER_PRODUCT)
+        self._mmapped = False
+        self._on_gpu = False
+        self._configure_index()
+        self._move_to_gpu()
+        self._reset_raw_vectors([])
+        logger.info(f"Created new FAISS {factory} index with dimension {self.dimension}")
+    
+    def _index_factory_string(self) -> str:
+        """Combine the index type with the configured vector encoding"""
+        index_type = config.FAISS_INDEX_TYPE
+        if _CORPUS_TRAINED_LAYOUT.search(index_type):
+            # Training on the first few chunks fails outright for IVF (fewer
+            # points than clusters) and gives useless PQ codebooks
+            raise ValueError(f"FAISS_INDEX_TYPE {index_type!r} cannot start an empty index; use "
+                             f"a graph or flat type and switch with rebuild_index() or "
+                             f"FAISS_IVFPQ_THRESHOLD once the corpus is large")
+        
+        # Scalar quantization: 1 byte (int8) or 2 bytes (fp16) per dimension
+        # instead of 4; fp16 needs no training and is nearly lossless
+        encodings = {"int8": "SQ8", "fp16": "SQfp16"}
+        encoding = encodings.get(config.VECTOR_QUANT)
+        if encoding is None:
+            return index_type
+        if index_type == "Flat":
+            return encoding
+        if _STORAGE_COMPONENT.search(index_type):
+            # e.g. "HNSW32,Flat" already says how vectors are stored
+            return index_type
+        return f"{index_type},{encoding}"
+    
+    def _uses_cosine(self) -> bool:
+        """Whether the index scores normalized vectors by inner product"""
+        # Indexes saved before the switch to inner product are still L2
+        return self.index.metric_type == faiss.METRIC_INNER_PRODUCT
+    
+    def _to_vectors(self, embeddings: Union[List[List[float]], np.ndarray]) -> np.ndarray:
+        """Convert embeddings to a float32 array, normalized (in place) for cosine indexes"""
+        vectors = np.asarray(embeddings, dtype='float32')
+        if self._uses_cosine():
+            faiss.normalize_L2(vectors)
+        return vectors
+    
+    def _move_to_gpu(self):
+        """Copy the index to every visible GPU when FAISS_USE_GPU is set"""
+        if not config.FAISS_USE_GPU or self._on_gpu:
+            return
+        
+        # faiss-cpu builds report no GPUs
+        if not hasattr(faiss, 'index_cpu_to_all_gpus') or faiss.get_num_gpus() == 0:
+            logger.warning("FAISS_USE_GPU is set but no GPU is available to FAISS")
+            return
+        
+        try:
+            self.index = faiss.index_cpu_to_all_gpus(self.index)
+        except RuntimeError as e:
+            # e.g. HNSW, which has no GPU implementation
+            logger.warning(f"Keeping FAISS index on the CPU: {e}")
+            return
+        
+        self._on_gpu = True
+        self._mmapped = False
+        logger.info(f"Moved FAISS index to {faiss.get_num_gpus()} GPU(s)")
+    
+    def _add_vectors(self, vectors: np.ndarray):
+        """Add vectors to the index, training it first if the encoding needs it"""
+        if not self.index.is_trained:
+            # int8 quantizer ranges are learned from the first batch added
+            # (IVF/PQ layouts only come from rebuild_index, trained there)
+            logger.info(f"Training FAISS index on {len(vectors)} vectors")
+            if len(vectors) < MIN_TRAINING_VECTORS:
+                logger.warning(f"Training on only {len(vectors)} vectors; seed a trained encoding "
+                               f"with a large first batch, or use VECTOR_QUANT='fp16'")
+            self.index.train(vectors)
+        self.index.add(vectors)
+        if self._raw_tracked:
+            self._raw_pending.append(np.array(vectors, dtype='float32'))
+    
+    def _configure_index(self):
+        """Apply HNSW or IVF search parameters if the index uses either"""
+        hnsw = getattr(self.index, 'hnsw', None)
+        if hnsw is not None:
+            hnsw.efConstruction = config.FAISS_HNSW_EF_CONSTRUCTION
+            hnsw.efSearch = config.FAISS_HNSW_EF_SEARCH
+        
+        try:
+            ivf = faiss.extract_index_ivf(self.index)
+        except RuntimeError:
+            ivf = None
+        if ivf is not None:
+            # Scan a few clusters instead of only the nearest one
+            ivf.nprobe = config.FAISS_IVF_NPROBE
     
     def add_documents(self, chunks: List[Dict[str, Any]], 
-                     batch_size: int = 32) -> int:
+                     batch_size: int = config.EMBEDDING_BATCH_SIZE) -> int:
         """
         Add document chunks to vector store
         
@@ -56,45 +212,105 @@ class FAISSVectorStore:
         
         if self.index is None:
             self.create_index()
+        elif self._mmapped:
+            # A read-only mapping cannot be added to; load a writable copy
+            logger.info("Reloading memory-mapped FAISS index for writing")
+            self._read_index(mmap=False)
         
         # Extract texts
         texts = [chunk['text'] for chunk in chunks]
         
-        # Generate embeddings in batches
-        logger.info(f"Generating embeddings for {len(texts)} chunks...")
-        embeddings = []
+        # Record token counts and source previews once so queries can budget
+        # context and list sources cheaply
+        uncounted = [chunk for chunk in chunks if 'token_count' not in chunk]
+        for chunk, count in zip(uncounted, estimate_tokens_batch([c['text'] for c in uncounted])):
+            chunk['token_count'] = count
+        for chunk in chunks:
+            chunk.setdefault('text_preview', chunk['text'][:200] + '...')
+        
+        # Generate embeddings in batches, several requests in flight at once
+        # (the calls mostly wait on Ollama); map() keeps them in order
+        # Repeated boilerplate (headers, TOC lines) is embedded only once;
+        # first_index[u] is the first chunk using unique text u
+        unique_positions = {}
+        first_index = []
+        positions = []
+        for i, text in enumerate(texts):
+            position = unique_positions.setdefault(text, len(unique_positions))
+            if position == len(first_index):
+                first_index.append(i)
+            positions.append(position)
+        unique_texts = list(unique_positions)
+        has_duplicates = len(unique_texts) < len(texts)
+        positions = np.asarray(positions)
+        
+        logger.info(f"Generating embeddings for {len(unique_texts)} unique of {len(texts)} chunks...")
+        batches = [unique_texts[i:i + batch_size] for i in range(0, len(unique_texts), batch_size)]
+        
+        # Each batch is written straight into one preallocated float32 array
+        # instead of collecting Python lists and converting them at the end
+        unique_embeddings = np.empty((len(unique_texts), self.index.d), dtype='float32')
+        
+        # A trained index takes each run of chunks as soon as all of their
+        # embeddings are in, so FAISS inserts overlap the Ollama calls still
+        # in flight; an untrained one must see the whole set first
+        streaming = self.index.is_trained
+        start = self.index.ntotal
+        done = 0
+        added = 0
         
-        for i in range(0, len(texts), batch_size):
-            batch_texts = texts[i:i + batch_size]
-            batch_embeddings = self.ollama.get_embeddings_batch(batch_texts)
-            embeddings.extend(batch_embeddings)
+        try:
+            with ThreadPoolExecutor(max_workers=min(config.EMBEDDING_CONCURRENCY, len(batches))) as executor:
+                for batch_embeddings in executor.map(self.ollama.get_embeddings_batch, batches):
+                    batch_vectors = unique_embeddings[done:done + len(batch_embeddings)]
+                    batch_vectors[:] = batch_embeddings
+                    # Normalize once here, not per query
+                    self._to_vectors(batch_vectors)
+                    done += len(batch_embeddings)
+                    
+                    logger.info(f"Processed {done}/{len(unique_texts)} embeddings")
+                    
+                    if streaming:
+                        ready = first_index[done] if done < len(first_index) else len(texts)
+                        if ready > added:
+                            if has_duplicates:
+                                self._add_vectors(unique_embeddings[positions[added:ready]])
+                            else:
+                                self._add_vectors(unique_embeddings[added:ready])
+                            added = ready
             
-            if (i + batch_size) % 100 == 0:
-                logger.info(f"Processed {min(i + batch_size, len(texts))}/{len(texts)} embeddings")
-        
-        # Convert to numpy array
-        embeddings_array = np.array(embeddings, dtype='float32')
-        
-        # Add to FAISS index
-        self.index.add(embeddings_array)
+            if not streaming:
+                # Scatter shared embeddings back to every chunk, then add
+                self._add_vectors(unique_embeddings[positions] if has_duplicates else unique_embeddings)
+        except Exception:
+            # Keep the index aligned with documents if embedding failed midway
+            if self.index.ntotal > start:
+                self._truncate_index(start)
+            raise
         
         # Store documents and metadata
+        self._index_chunk_ids(chunks, len(self.metadata))
         self.documents.extend(texts)
         self.metadata.extend(chunks)
+        self._filename_counts.update(_file_name(chunk) for chunk in chunks)
+        self._dirty = True
+        self._compress_if_large()
         
         logger.info(f"Added {len(chunks)} chunks to vector store. Total: {len(self.documents)}")
         
         return len(chunks)
     
     def search(self, query: str, top_k: int = config.TOP_K_RETRIEVAL,
-               threshold: float = config.SIMILARITY_THRESHOLD) -> List[Dict[str, Any]]:
+               threshold: float = config.SIMILARITY_THRESHOLD,
+               query_embedding: Optional[List[float]] = None) -> List[Dict[str, Any]]:
         """
         Search for similar documents
         
         Args:
             query: Search query
             top_k: Number of results to return
-            threshold: Similarity threshold (distance threshold)
+            threshold: Minimum cosine similarity (0 or less keeps every hit)
+            query_embedding: Embedding of query, if already computed
         
         Returns:
             List of matching chunks with scores
@@ -104,42 +320,83 @@ class FAISSVectorStore:
             return []
         
         # Generate query embedding
-        query_embedding = self.ollama.get_embedding(query)
-        query_vector = np.array([query_embedding], dtype='float32')
+        if query_embedding is None:
+            query_embedding = self.ollama.get_embedding(query)
+        query_vector = self._to_vectors([query_embedding])
         
         # Search
         distances, indices = self.index.search(query_vector, top_k)
         
-        # Debug logging
-        logger.info(f"Search returned distances: {distances[0][:3]}, indices: {indices[0][:3]}")
-        logger.info(f"Index total: {self.index.ntotal}, Documents: {len(self.documents)}, Threshold: {threshold}")
+        # Formatting numpy rows is not free, so only do it when DEBUG is on
+        if logger.isEnabledFor(logging.DEBUG):
+            logger.debug(f"Search returned distances: {distances[0][:3]}, indices: {indices[0][:3]}")
+            logger.debug(f"Index total: {self.index.ntotal}, Documents: {len(self.documents)}, Threshold: {threshold}")
         
-        # Format results
-        results = []
-        for idx, (distance, doc_idx) in enumerate(zip(distances[0], indices[0])):
-            logger.debug(f"Processing idx={idx}, doc_idx={doc_idx}, distance={distance}")
-            
-            if doc_idx >= 0 and doc_idx < len(self.documents):  # FAISS returns -1 for invalid indices
-                # Convert L2 distance to similarity score
-                # Using negative distance so higher score = better match
-                similarity = 1 / (1 + float(distance))
-                
-                logger.debug(f"Similarity: {similarity}, Threshold: {threshold}, Pass: {threshold <= 0 or similarity >= threshold}")
-                
-                # Filter by threshold (only if threshold > 0)
-                if threshold <= 0 or similarity >= threshold:
-                    result = {
-                        'text': self.documents[doc_idx],
-                        'metadata': self.metadata[doc_idx],
-                        'score': float(similarity),
-                        'distance': float(distance),
-                        'rank': idx + 1
-                    }
-                    results.append(result)
+        results = self._format_hits(distances[0], indices[0], threshold)
         
         logger.info(f"Found {len(results)} relevant chunks for query (from {top_k} searched)")
         return results
     
+    def search_batch(self, queries: List[str], top_k: int = config.TOP_K_RETRIEVAL,
+                     threshold: float = config.SIMILARITY_THRESHOLD) -> List[List[Dict[str, Any]]]:
+        """
+        Search for several queries at once
+        
+        The queries are embedded in one batch request and searched with a
+        single index.search call, which FAISS parallelizes across queries
+        (a single-vector search runs on one thread).
+        
+        Args:
+            queries: Search queries
+            top_k: Number of results to return per query
+            threshold: Minimum cosine similarity (0 or less keeps every hit)
+        
+        Returns:
+            One list of matching chunks with scores per query, in query order
+        """
+        if not queries:
+            return []
+        
+        if self.index is None or self.index.ntotal == 0:
+            logger.warning("Vector store is empty")
+            return [[] for _ in queries]
+        
+        query_vectors = self._to_vectors(self.ollama.get_embeddings_batch(queries))
+        distances, indices = self.index.search(query_vectors, top_k)
+        
+        return [self._format_hits(row_distances, row_indices, threshold)
+                for row_distances, row_indices in zip(distances, indices)]
+    
+    def _format_hits(self, distances: np.ndarray, indices: np.ndarray,
+                     threshold: float) -> List[Dict[str, Any]]:
+        """Turn one row of FAISS search output into scored chunk results"""
+        distances = np.asarray(distances, dtype=np.float32)
+        indices = np.asarray(indices)
+        if self._uses_cosine():
+            # Inner product of normalized vectors is cosine similarity
+            similarities = distances
+        else:
+            # Convert L2 distance to similarity score
+            similarities = 1.0 / (1.0 + distances)
+        
+        # FAISS returns -1 for invalid indices; filter by threshold only if threshold > 0
+        mask = (indices >= 0) & (indices < len(self.documents))
+        if threshold > 0:
+            mask &= similarities >= threshold
+        
+        results = []
+        for rank in np.nonzero(mask)[0].tolist():
+            doc_idx = int(indices[rank])
+            results.append({
+                'text': self.documents[doc_idx],
+                'metadata': self.metadata[doc_idx],
+                'score': float(similarities[rank]),
+                'distance': float(distances[rank]),
+                'rank': rank + 1
+            })
+        
+        return results
+    
     def search_with_filter(self, query: str, filter_fn, top_k: int = 10) -> List[Dict[str, Any]]:
         """
         Search with custom filter function
@@ -160,6 +417,29 @@ class FAISSVectorStore:
         
         return filtered_results[:top_k]
     
+    def get_chunk_by_id(self, chunk_id: str) -> Optional[Dict[str, Any]]:
+        """
+        Look up a stored chunk by the 'chunk_id' in its context
+        
+        Args:
+            chunk_id: ID assigned to the chunk at ingest time
+        
+        Returns:
+            Chunk with 'text' and 'metadata', or None if it is not stored
+        """
+        doc_idx = self._chunk_positions.get(chunk_id)
+        if doc_idx is None:
+            return None
+        return {'text': self.documents[doc_idx], 'metadata': self.metadata[doc_idx]}
+    
+    def _index_chunk_ids(self, chunks: List[Dict[str, Any]], start: int):
+        """Record the positions of chunks stored from position start onwards"""
+        for offset, chunk in enumerate(chunks):
+            chunk_id = chunk.get('context', {}).get('chunk_id')
+            if chunk_id is not None:
+                # First occurrence wins, as with the previous linear scan
+                self._chunk_positions.setdefault(chunk_id, start + offset)
+    
     def save(self):
         """Save index and documents to disk"""
         if self.index is None:
@@ -167,52 +447,291 @@ class FAISSVectorStore:
             return
         
         try:
-            # Save FAISS index
-            faiss.write_index(self.index, self.index_path)
+            # Save chunks as zstd-compressed msgpack; documents are just each
+            # chunk's text, so they are rebuilt on load instead of stored twice.
+            # threads=-1 compresses on all cores
+            compressor = zstandard.ZstdCompressor(level=3, threads=-1)
+            appendable = (self._persisted_count is not None
+                          and os.path.exists(self.store_path)
+                          and os.path.exists(self.index_path))
+            tmp_path = self.store_path + ".tmp"
+            
+            # Chunks are written before the index, so a save cut short leaves
+            # surplus chunks at the end, which load() drops
+            if appendable:
+                # Only chunks were added since the last save: append them as
+                # another zstd frame instead of rewriting the whole store
+                new_chunks = self.metadata[self._persisted_count:]
+                if new_chunks:
+                    packed = _pack(new_chunks)
+                    with open(self.store_path, 'ab') as f:
+                        f.write(compressor.compress(packed))
+            else:
+                packed = _pack(self.metadata)
+                with open(tmp_path, 'wb') as f:
+                    f.write(compressor.compress(packed))
+            
+            # Save FAISS index (via a temporary file, since a memory-mapped
+            # index may still be reading the current one)
+            tmp_index_path = self.index_path + ".tmp"
+            cpu_index = faiss.index_gpu_to_cpu(self.index) if self._on_gpu else self.index
+            faiss.write_index(cpu_index, tmp_index_path)
             
-            # Save documents
-            with open(self.docs_path, 'wb') as f:
-                pickle.dump(self.documents, f)
+            # A rewritten store (after a delete) no longer pairs with the old
+            # index by position, so both files are swapped in back to back
+            if not appendable:
+                os.replace(tmp_path, self.store_path)
+            os.replace(tmp_index_path, self.index_path)
+            self._persisted_count = len(self.metadata)
             
-            # Save metadata
-            with open(self.meta_path, 'wb') as f:
-                pickle.dump(self.metadata, f)
+            if self._raw_tracked:
+                self._save_raw_vectors()
+            elif os.path.exists(self.vectors_path):
+                # A stale copy could later line up with a different index
+                os.remove(self.vectors_path)
+            self._dirty = False
             
             logger.info(f"Saved vector store with {len(self.documents)} documents")
         
         except Exception as e:
             logger.error(f"Error saving vector store: {e}")
+            # The store may already hold this save's appended chunks; rewrite
+            # it next time rather than appending them twice
+            self._persisted_count = None
             raise
     
+    def flush(self):
+        """Save to disk only if chunks were added since the last save"""
+        if self._dirty:
+            self.save()
+    
     def load(self):
         """Load index and documents from disk"""
         if not os.path.exists(self.index_path):
             logger.info("No existing index found, will create new one")
+            # A chunk store left without its index pairs with nothing; the
+            # first save rewrites it instead of appending to it
+            self._persisted_count = None
             return
         
         try:
             # Load FAISS index
-            self.index = faiss.read_index(self.index_path)
+            self._read_index(mmap=config.FAISS_INDEX_MMAP)
             
-            # Load documents
-            with open(self.docs_path, 'rb') as f:
-                self.documents = pickle.load(f)
+            if os.path.exists(self.store_path):
+                self.metadata = self._read_store()
+                self.documents = [chunk['text'] for chunk in self.metadata]
+            else:
+                # Legacy pickle format; the next save() migrates it
+                with open(self.docs_path, 'rb') as f:
+                    self.documents = pickle.load(f)
+                
+                with open(self.meta_path, 'rb') as f:
+                    self.metadata = pickle.load(f)
+                self._persisted_count = None
             
-            # Load metadata
-            with open(self.meta_path, 'rb') as f:
-                self.metadata = pickle.load(f)
+            self._load_raw_vectors()
+            self._align_store()
             
+            self._filename_counts = Counter(_file_name(m) for m in self.metadata)
+            self._chunk_positions = {}
+            self._index_chunk_ids(self.metadata, 0)
             logger.info(f"Loaded vector store with {len(self.documents)} documents")
+            
+            if not self._uses_cosine():
+                self._migrate_to_cosine()
+            self._move_to_gpu()
         
+        except StoreMismatchError:
+            raise
         except Exception as e:
             logger.error(f"Error loading vector store: {e}")
             self.create_index()
+            self._persisted_count = None
+    
+    def _align_store(self):
+        """
+        Pair every stored chunk with exactly one index vector after a load
+        
+        A save cut short leaves either chunks without vectors (the index
+        was not rewritten) or, for stores saved by older versions, vectors
+        without chunks. Either tail is dropped so later adds line up again;
+        the next save rewrites both files.
+        
+        Raises:
+            StoreMismatchError: If surplus vectors cannot be removed
+        """
+        ntotal = self.index.ntotal
+        if len(self.metadata) == ntotal:
+            return
+        
+        logger.warning(f"Chunk store has {len(self.metadata)} chunks for {ntotal} vectors; "
+                       f"dropping the unpaired tail")
+        if len(self.metadata) > ntotal:
+            del self.metadata[ntotal:]
+            del self.documents[ntotal:]
+        else:
+            if self._mmapped:
+                self._read_index(mmap=False)
+            try:
+                self._truncate_index(len(self.metadata))
+            except RuntimeError as e:
+                # Starting empty here would let the next save wipe the store
+                raise StoreMismatchError(f"Index has {ntotal} vectors for {len(self.metadata)} "
+                                         f"chunks and cannot be trimmed: {e}") from e
+        
+        self._persisted_count = None
+        self._dirty = True
+    
+    def _reset_raw_vectors(self, rows: List[np.ndarray]):
+        """Start tracking raw vectors from the given rows, replacing vectors.f32 on the next save"""
+        self._raw_tracked = config.FAISS_KEEP_RAW_VECTORS
+        self._raw_saved = None
+        self._raw_pending = list(rows) if self._raw_tracked else []
+        self._raw_rewrite = True
+    
+    def _raw_vectors(self) -> np.ndarray:
+        """All tracked raw vectors, in index order"""
+        parts = ([self._raw_saved] if self._raw_saved is not None else []) + self._raw_pending
+        if not parts:
+            return np.empty((0, self.dimension), dtype='float32')
+        return np.concatenate(parts)
+    
+    def _load_raw_vectors(self):
+        """Map vectors.f32 if it matches the loaded index"""
+        self._raw_tracked = False
+        self._raw_saved = None
+        self._raw_pending = []
+        self._raw_rewrite = True
+        if not config.FAISS_KEEP_RAW_VECTORS:
+            return
+        
+        if not os.path.exists(self.vectors_path):
+            # Raw copies can only start from an empty index
+            self._raw_tracked = self.index.ntotal == 0
+            if not self._raw_tracked:
+                logger.info("No raw vector file for this index; rebuilds use reconstructed vectors")
+            return
+        
+        row_bytes = self.dimension * 4
+        rows = os.path.getsize(self.vectors_path) // row_bytes
+        if rows != self.index.ntotal:
+            logger.warning(f"Raw vector file has {rows} rows for {self.index.ntotal} indexed vectors; discarding it")
+            os.remove(self.vectors_path)
+            return
+        
+        if rows:
+            self._raw_saved = np.memmap(self.vectors_path, dtype='float32', mode='r',
+                                        shape=(rows, self.dimension))
+        self._raw_tracked = True
+        self._raw_rewrite = False
+    
+    def _save_raw_vectors(self):
+        """Append rows added since the last save to vectors.f32 (or rewrite it)"""
+        self._raw_saved = None  # Release the mapping before the file changes
+        if self._raw_rewrite or not os.path.exists(self.vectors_path):
+            tmp_path = self.vectors_path + ".tmp"
+            with open(tmp_path, 'wb') as f:
+                for rows in self._raw_pending:
+                    f.write(rows.tobytes())
+            os.replace(tmp_path, self.vectors_path)
+        elif self._raw_pending:
+            with open(self.vectors_path, 'ab') as f:
+                for rows in self._raw_pending:
+                    f.write(rows.tobytes())
+        
+        rows = os.path.getsize(self.vectors_path) // (self.dimension * 4)
+        self._raw_saved = (np.memmap(self.vectors_path, dtype='float32', mode='r',
+                                     shape=(rows, self.dimension)) if rows else None)
+        self._raw_pending = []
+        self._raw_rewrite = False
+    
+    def _read_store(self) -> List[Dict[str, Any]]:
+        """
+        Read chunks from the store file
+        
+        The file is a sequence of zstd frames, one per save, each holding a
+        msgpack list of chunks. Files from older versions hold a single
+        {'metadata': [...]} map instead.
+        
+        Returns:
+            List of chunk dictionaries
+        """
+        chunks = []
+        # Decompress while unpacking instead of holding the compressed
+        # file and the whole decompressed buffer at once
+        with open(self.store_path, 'rb') as f:
+            reader = zstandard.ZstdDecompressor().stream_reader(f, read_across_frames=True)
+            unpacker = msgpack.Unpacker(reader, raw=False, max_buffer_size=0)
+            try:
+                for batch in unpacker:
+                    if isinstance(batch, dict):
+                        batch = batch['metadata']
+                    chunks.extend(batch)
+            except (zstandard.ZstdError, msgpack.UnpackException, ValueError) as e:
+                # A half-written last frame from an interrupted append; keep
+                # the complete frames before it and rewrite on the next save
+                logger.warning(f"Chunk store ends in a damaged frame, kept {len(chunks)} chunks: {e}")
+                self._persisted_count = None
+                return chunks
+        
+        self._persisted_count = len(chunks)
+        return chunks
+    
+    def _migrate_to_cosine(self):
+        """
+        Rebuild an L2 index saved by older versions as a cosine (inner product) index
+        
+        The stored vectors are reconstructed and normalized, so no text is
+        re-embedded; the next save() persists the new index. Indexes that
+        cannot reconstruct their vectors keep L2 scoring.
+        """
+        try:
+            vectors = self.index.reconstruct_n(0, self.index.ntotal)
+        except RuntimeError as e:
+            logger.warning(f"Keeping L2 index, vectors cannot be reconstructed: {e}")
+            return
+        
+        logger.info(f"Migrating {len(vectors)} vectors from L2 to a cosine index")
+        self.create_index()
+        if len(vectors):
+            self._add_vectors(self._to_vectors(vectors))
+        self._dirty = True
+    
+    def _read_index(self, mmap: bool = False):
+        """
+        Read the saved FAISS index
+        
+        Args:
+            mmap: Map the file read-only instead of copying it into memory, so
+                IVF inverted lists stay in the page cache and load on demand
+                (other index types are still read into memory by FAISS)
+        """
+        if mmap:
+            try:
+                self.index = faiss.read_index(self.index_path, faiss.IO_FLAG_MMAP | faiss.IO_FLAG_READ_ONLY)
+            except RuntimeError as e:
+                logger.warning(f"Cannot memory-map FAISS index, reading it instead: {e}")
+                mmap = False
+        if not mmap:
+            self.index = faiss.read_index(self.index_path)
+        self._mmapped = mmap
+        self._on_gpu = False
+        self._configure_index()
+        
+        if mmap:
+            # Pull the mapped file into the page cache in the background so
+            # the first searches do not stall on disk reads
+            threading.Thread(target=_prefault_file, args=(self.index_path,), daemon=True).start()
     
     def clear(self):
         """Clear all data from vector store"""
         self.create_index()
         self.documents = []
         self.metadata = []
+        self._persisted_count = None
+        self._filename_counts.clear()
+        self._chunk_positions = {}
         logger.info("Cleared vector store")
     
     def get_stats(self) -> Dict[str, Any]:
@@ -221,10 +740,140 @@ class FAISSVectorStore:
             'total_chunks': len(self.documents),
             'index_size': self.index.ntotal if self.index else 0,
             'dimension': self.dimension,
-            'unique_documents': len(set(m.get('context', {}).get('file_name', '') 
-                                       for m in self.metadata))
+            'unique_documents': len(self._filename_counts)
         }
     
+    def rebuild_index(self, factory: Optional[str] = None) -> str:
+        """
+        Rebuild the index from its stored vectors with a different layout
+        
+        Meant for moving a large corpus to IVF-PQ, which stores FAISS_PQ_M
+        bytes per vector and searches only FAISS_IVF_NPROBE clusters. Nothing
+        is re-embedded.
+        
+        Args:
+            factory: faiss.index_factory string (defaults to IVF-PQ sized for the corpus)
+        
+        Returns:
+            The factory string used
+        """
+        vectors = self._reconstruct_vectors(list(range(self.index.ntotal)))
+        if vectors is None:
+            raise RuntimeError("Index vectors cannot be reconstructed for a rebuild")
+        
+        if factory is None:
+            # About 4 * sqrt(N) clusters, as commonly recommended for IVF
+            nlist = max(1, int(4 * np.sqrt(len(vectors))))
+            factory = f"IVF{nlist},PQ{config.FAISS_PQ_M}"
+        
+        index = faiss.index_factory(self.dimension, factory, faiss.METRIC_INNER_PRODUCT)
+        if not index.is_trained:
+            # Train on a random sample of at least ~30 vectors per cluster
+            ivf = faiss.extract_index_ivf(index) if 'IVF' in factory else None
+            sample_size = min(len(vectors), max(30 * (ivf.nlist if ivf else 1), 10000))
+            sample = np.random.default_rng(0).choice(len(vectors), sample_size, replace=False)
+            logger.info(f"Training {factory} index on {sample_size} of {len(vectors)} vectors")
+            index.train(vectors[np.sort(sample)])
+        index.add(vectors)
+        
+        self.index = index
+        self._mmapped = False
+        self._on_gpu = False
+        self._configure_index()
+        self._move_to_gpu()
+        self._dirty = True
+        
+        logger.info(f"Rebuilt FAISS index as {factory} with {index.ntotal} vectors")
+        return factory
+    
+    def _compress_if_large(self):
+        """Switch to IVF-PQ once the index reaches FAISS_IVFPQ_THRESHOLD vectors"""
+        threshold = config.FAISS_IVFPQ_THRESHOLD
+        if threshold <= 0 or self.index.ntotal < threshold:
+            return
+        
+        try:
+            faiss.extract_index_ivf(self.index)
+            return  # already IVF
+        except RuntimeError:
+            pass
+        
+        try:
+            self.rebuild_index()
+        except RuntimeError as e:
+            logger.warning(f"Could not rebuild index as IVF-PQ: {e}")
+    
+    def _truncate_index(self, count: int):
+        """
+        Drop every vector after the first count
+        
+        Args:
+            count: Number of leading vectors to keep
+        """
+        kept_raw = self._raw_vectors()[:count] if self._raw_tracked else None
+        try:
+            self.index.remove_ids(faiss.IDSelectorRange(count, self.index.ntotal))
+            if kept_raw is not None:
+                self._reset_raw_vectors([kept_raw])
+            return
+        except RuntimeError:
+            pass  # HNSW cannot remove entries in place
+        
+        # Rebuild from the kept vectors; this runs right after a failed add,
+        # so it never goes back to Ollama for them
+        kept_vectors = kept_raw if kept_raw is not None else self._reconstruct_vectors(list(range(count)))
+        if count and kept_vectors is None:
+            raise RuntimeError(f"Cannot roll back the index to {count} vectors: "
+                               f"they cannot be reconstructed")
+        
+        self.create_index()
+        if count:
+            # create_index() emptied the raw copies; re-adding refills them
+            # with exactly kept_raw
+            self._add_vectors(self._to_vectors(kept_vectors))
+    
+    def _reset_index(self):
+        """
+        Replace the index with an empty one of the same layout
+        
+        Unlike create_index(), this keeps a rebuilt IVF-PQ layout and its
+        trained centroids and codebooks, so nothing is retrained.
+        """
+        cpu_index = faiss.index_gpu_to_cpu(self.index) if self._on_gpu else self.index
+        try:
+            index = faiss.clone_index(cpu_index)
+        except RuntimeError as e:
+            logger.warning(f"Cannot clone FAISS index, creating a new one: {e}")
+            self.create_index()
+            return
+        
+        index.reset()
+        self.index = index
+        self._mmapped = False
+        self._on_gpu = False
+        self._configure_index()
+        self._move_to_gpu()
+        self._reset_raw_vectors([])
+    
+    def _reconstruct_vectors(self, positions: List[int]) -> Optional[np.ndarray]:
+        """Stored vectors at the given index positions, or None if they cannot be recovered"""
+        if self._raw_tracked:
+            # Exact copies, even for lossy encodings
+            return self._raw_vectors()[positions]
+        
+        try:
+            try:
+                # IVF indexes need a direct map to look vectors up by id
+                faiss.extract_index_ivf(self.index).make_direct_map()
+            except RuntimeError:
+                pass
+            vectors = self.index.reconstruct_n(0, self.index.ntotal)
+        except RuntimeError as e:
+            logger.warning(f"Cannot reconstruct stored vectors: {e}")
+            return None
+        
+        return vectors[positions]
+    
     def delete_by_filename(self, filename: str) -> int:
         """
         Delete all chunks from a specific file
@@ -241,8 +890,7 @@ class FAISSVectorStore:
         new_metadata = []
         
         for idx, meta in enumerate(self.metadata):
-            file_name = meta.get('context', {}).get('file_name', '')
-            if file_name != filename:
+            if _file_name(meta) != filename:
                 indices_to_keep.append(idx)
                 new_documents.append(self.documents[idx])
                 new_metadata.append(meta)
@@ -250,24 +898,58 @@ class FAISSVectorStore:
         removed_count = len(self.documents) - len(new_documents)
         
         if removed_count > 0:
-            # Rebuild index with remaining documents
+            if self._mmapped:
+                # A read-only mapping cannot be cloned; load a writable copy
+                self._read_index(mmap=False)
+            
+            # Rebuild index with remaining documents, reusing their stored
+            # vectors (HNSW cannot remove entries in place, and IVF would
+            # leave gaps in the positions chunks are looked up by)
+            kept_vectors = self._reconstruct_vectors(indices_to_keep)
             self.documents = new_documents
             self.metadata = new_metadata
+            self._persisted_count = None
+            del self._filename_counts[filename]
+            self._chunk_positions = {}
+            self._index_chunk_ids(self.metadata, 0)
             
-            # Recreate index
-            self.create_index()
+            # Recreate index in its current layout
+            self._reset_index()
             
             if self.documents:
-                # Re-embed all documents (necessary for FAISS)
-                logger.info(f"Re-indexing {len(self.documents)} remaining documents...")
-                embeddings = self.ollama.get_embeddings_batch(self.documents)
-                embeddings_array = np.array(embeddings, dtype='float32')
-                self.index.add(embeddings_array)
+                if kept_vectors is None:
+                    # Re-embed all documents when the index cannot return its vectors
+                    logger.info(f"Re-indexing {len(self.documents)} remaining documents...")
+                    kept_vectors = self.ollama.get_embeddings_batch(self.documents)
+                self._add_vectors(self._to_vectors(kept_vectors))
+            self._dirty = True
+            self._compress_if_large()
             
             logger.info(f"Removed {removed_count} chunks from {filename}")
         
         return removed_count
 
 
+def _file_name(chunk: Dict[str, Any]) -> str:
+    """Source file name recorded in a chunk's context"""
+    return chunk.get('context', {}).get('file_name', '')
+
+
+def _prefault_file(path: str):
+    """Load a file into the OS page cache (kernel readahead where supported)"""
+    try:
+        with open(path, 'rb') as f:
+            if hasattr(os, 'posix_fadvise'):
+                os.posix_fadvise(f.fileno(), 0, 0, os.POSIX_FADV_WILLNEED)
+                return
+            
+            # No readahead hint (e.g. Windows): read it through once
+            buffer = bytearray(1 << 20)
+            while f.readinto(buffer):
+                pass
+    except OSError as e:
+        logger.debug(f"Could not prefault {path}: {e}")
+
+
 logger.info("FAISS vector store initialized")
 
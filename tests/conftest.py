@@ -0,0 +1,12 @@
+"""
+Shared test setup
+"""
+import os
+import tempfile
+
+import config
+
+# src.utils.helpers opens config.LOG_FILE when first imported; keep test
+# runs from writing into the working tree's logs/
+config.LOG_DIR = tempfile.mkdtemp(prefix="reasoning_rag_logs_")
+config.LOG_FILE = os.path.join(config.LOG_DIR, "reasoning_rag.log")
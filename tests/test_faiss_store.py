@@ -0,0 +1,52 @@
+"""
+Tests for FAISS vector store persistence
+"""
+import os
+
+import numpy as np
+import pytest
+
+pytest.importorskip("faiss")
+
+import config
+from src.vectorstore.faiss_store import FAISSVectorStore
+
+
+class FakeOllama:
+    """Deterministic embeddings keyed on the text, no server needed"""
+    
+    def get_embedding(self, text):
+        return self.get_embeddings_batch([text])[0]
+    
+    def get_embeddings_batch(self, texts):
+        return [np.random.default_rng(sum(map(ord, text))).random(config.EMBEDDING_DIM).tolist()
+                for text in texts]
+
+
+@pytest.fixture
+def store_dir(tmp_path, monkeypatch):
+    monkeypatch.setattr(config, "VECTOR_DB_PATH", str(tmp_path))
+    monkeypatch.setattr(config, "FAISS_INDEX_PATH", str(tmp_path / "faiss_index"))
+    monkeypatch.setattr(config, "EMBEDDING_DIM", 8)
+    monkeypatch.setattr(config, "FAISS_INDEX_TYPE", "Flat")
+    monkeypatch.setattr(config, "VECTOR_QUANT", "fp32")
+    monkeypatch.setattr(config, "FAISS_KEEP_RAW_VECTORS", False)
+    monkeypatch.setattr(config, "FAISS_INDEX_MMAP", False)
+    return tmp_path
+
+
+def test_store_without_index_is_rewritten_not_appended(store_dir):
+    store = FAISSVectorStore(FakeOllama())
+    store.add_documents([{'text': 'stale chunk', 'context': {'file_name': 'old.txt'}}])
+    store.save()
+    
+    # Chunk store survives but its index is gone
+    os.remove(config.FAISS_INDEX_PATH)
+    
+    store = FAISSVectorStore(FakeOllama())
+    store.add_documents([{'text': 'fresh chunk', 'context': {'file_name': 'new.txt'}}])
+    store.save()
+    
+    reloaded = FAISSVectorStore(FakeOllama())
+    assert reloaded.documents == ['fresh chunk']
+    assert reloaded.index.ntotal == 1